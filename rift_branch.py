@@ -0,0 +1,73 @@
+# Branch several inversion scenarios from one rift-phase checkpoint.
+#
+#   mpirun -np 192 python rift_branch.py branches.json
+#
+# The reference checkpoint is read once, kept in memory, and every branch
+# restarts from that in-memory copy with its own velocity and duration. Branches
+# run through rift_model.run_initialised, so they get the same solver profile,
+# scheduled outputs, diagnostics, instrumentation and checkpoints as a full run.
+#
+# branches.json looks like
+#   {"base": "Narrow_Rift", "outputDir": "Branch_Narrow_Rift",
+#    "reference": {"restartDir": "Rift_Narrow", "restartStep": 40},
+#    "branches": [{"name": "slow", "velocity": -0.5, "duration": 4000000},
+#                 {"name": "fast", "velocity": -2.0}]}
+# Branches may only change velocity (cm/yr) and duration (yr), anything else
+# would not match the reference state.
+#Written by Youseph Ibrahim
+
+import argparse
+import json
+
+import rift_sweep
+from rift_model import attach_swarm_variables, build_model, run_initialised, set_velocityBCs
+from rift_state import snapshot_state, restore_state
+
+BRANCH_KEYS = ("name", "velocity", "duration")
+
+
+def branch_specs(config):
+    specs = []
+    for branch in config["branches"]:
+        unknown = set(branch) - set(BRANCH_KEYS)
+        if unknown:
+            raise ValueError("Branch {0} changes {1}, branches can only change velocity and duration".format(
+                branch["name"], ", ".join(sorted(unknown))))
+        specs.append(rift_sweep.member_spec(config, branch))
+    return specs
+
+
+def run_branches(config):
+    specs = branch_specs(config)
+    reference = config["reference"]
+
+    #Every branch has the same geometry and material setup, so one Model serves them all.
+    #The temperature and pressure come from the reference checkpoint, skip their initialisation.
+    Model = build_model(specs[0])
+    Model.init_model(temperature=False, pressure=False)
+    Model.restart(step=reference["restartStep"], restartDir=reference["restartDir"])
+    #The restart replaces the swarm, the reference state has to hold the variables the run adds to it
+    attach_swarm_variables(Model)
+    state = snapshot_state(Model)
+
+    for index, spec in enumerate(specs):
+        if index > 0:
+            lost = restore_state(Model, state)
+            if lost:
+                raise RuntimeError("{0} particles could not be restored for branch {1}".format(lost, spec["name"]))
+        Model.outputDir = spec["outputDir"]
+        set_velocityBCs(Model, spec)
+        run_initialised(Model, spec)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run inversion branches from one reference checkpoint")
+    parser.add_argument("branches", help="JSON file describing the reference checkpoint and the branches")
+    args = parser.parse_args(argv)
+
+    with open(args.branches) as f:
+        run_branches(json.load(f))
+
+
+if __name__ == "__main__":
+    main()
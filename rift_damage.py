@@ -0,0 +1,43 @@
+# Initial damage from a hash of the particle coordinates.
+#
+# Counter-based hashing instead of np.random, so a particle gets the same random
+# number whichever rank owns it, however many ranks there are and in whatever
+# order the particles are stored. Plain NumPy, see rift_model.seed_damage for
+# how it is applied to a model.
+#Written by Youseph Ibrahim
+
+import numpy as np
+
+HASH_SCALE = 2.0**32   #quantisation of the non-dimensional particle coordinates
+DAMAGE_CHUNK = 65536   #particles per block, bounds the size of the temporaries
+
+
+def _splitmix64(z):
+    z += np.uint64(0x9E3779B97F4A7C15)
+    z ^= z >> np.uint64(30)
+    z *= np.uint64(0xBF58476D1CE4E5B9)
+    z ^= z >> np.uint64(27)
+    z *= np.uint64(0x94D049BB133111EB)
+    z ^= z >> np.uint64(31)
+    return z
+
+
+def hashed_uniform(coords, seed):
+    """Uniform numbers in [0, 1) from a hash of the particle coordinates and a seed."""
+    h = np.rint(coords[:, 1] * HASH_SCALE).astype(np.int64).view(np.uint64)
+    h ^= _splitmix64(np.full(len(coords), seed, dtype=np.uint64))
+    h = _splitmix64(h)
+    h ^= np.rint(coords[:, 0] * HASH_SCALE).astype(np.int64).view(np.uint64)
+    h = _splitmix64(h)
+    return (h >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+
+def damage_field(coords, maxDamage, centre, width, verticalWidth, surface, seed, out):
+    """Random damage under two Gaussians, zero above surface, written into out."""
+    for start in range(0, len(coords), DAMAGE_CHUNK):
+        xy = coords[start:start + DAMAGE_CHUNK]
+        value = hashed_uniform(xy, seed)
+        value *= maxDamage * np.exp(-(xy[:, 0] - centre[0])**2 / width
+                                    - (xy[:, 1] - centre[1])**2 / verticalWidth)
+        value[xy[:, 1] > surface] = 0.0
+        out[start:start + DAMAGE_CHUNK] = value
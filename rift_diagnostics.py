@@ -0,0 +1,217 @@
+# In-situ diagnostic reductions.
+#
+# Most of what gets plotted from a run is low dimensional, so instead of writing
+# full fields the diagnostics registered here are reduced over all ranks at their
+# own cadence (spec["diagnostics"]) and appended to compact time series:
+# scalars as one JSON line per evaluation in <outputDir>/diagnostics.jsonl and
+# profiles as rows of extendable datasets in <outputDir>/diagnostics.h5.
+# A restarted run first drops the rows of both past the restart time, which it
+# is about to write again.
+#Written by Youseph Ibrahim
+
+import json
+import os
+
+import h5py
+import numpy as np
+from mpi4py import MPI
+
+DIAGNOSTICS = {}
+
+
+def diagnostic(name):
+    """Register a reduction. It is called as function(Model, spec, comm) on every
+    rank and returns {"scalars": {...}, "profiles": {...}}, reduced over comm."""
+    def register(function):
+        DIAGNOSTICS[name] = function
+        return function
+    return register
+
+
+def append_row(group, name, row, dtype=None):
+    """Append row to the dataset name of group, creating it (extendable along the
+    first axis and chunked one row per chunk) if needed."""
+    row = np.asarray(row, dtype=dtype)
+    if name not in group:
+        group.create_dataset(name, shape=(0,) + row.shape, maxshape=(None,) + row.shape,
+                             dtype=row.dtype, chunks=(1,) + row.shape,
+                             compression="gzip", shuffle=True)
+    ds = group[name]
+    ds.resize(ds.shape[0] + 1, axis=0)
+    ds[-1] = row
+    return ds
+
+
+def _x_bins(Model, spec):
+    from rift_model import GEO
+    minX, maxX = GEO.nd(Model.minCoord[0]), GEO.nd(Model.maxCoord[0])
+    return minX, maxX, spec["diagnostics"]["bins"]
+
+
+def _line_profile(Model, spec, comm, tracerName):
+    """Mean depth (km) of a line of passive tracers in bins along x, NaN where empty."""
+    from rift_model import GEO, u
+    minX, maxX, nbins = _x_bins(Model, spec)
+    coords = Model.tracers_by_name[tracerName].particleCoordinates.data
+    index = np.clip(((coords[:, 0] - minX) * (nbins / (maxX - minX))).astype(int), 0, nbins - 1)
+    local = np.zeros((2, nbins))
+    local[0] = np.bincount(index, weights=coords[:, 1], minlength=nbins)
+    local[1] = np.bincount(index, minlength=nbins)
+    total = np.empty_like(local)
+    comm.Allreduce(local, total, op=MPI.SUM)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        profile = total[0] / total[1]
+    return GEO.dimensionalise(profile, u.kilometer).magnitude
+
+
+@diagnostic("surface profile")
+def surface_profile(Model, spec, comm):
+    elevation = _line_profile(Model, spec, comm, "Surface")
+    return {"scalars": {"max elevation (km)": float(np.nanmax(elevation)),
+                        "min elevation (km)": float(np.nanmin(elevation))},
+            "profiles": {"surface elevation (km)": elevation}}
+
+
+@diagnostic("moho profile")
+def moho_profile(Model, spec, comm):
+    depth = -_line_profile(Model, spec, comm, "Moho")
+    return {"scalars": {"max Moho depth (km)": float(np.nanmax(depth))},
+            "profiles": {"Moho depth (km)": depth}}
+
+
+@diagnostic("melt")
+def melt_per_material(Model, spec, comm):
+    """Mean melt fraction and the number of particles carrying melt, per material."""
+    names = {material.index: material.name for material in Model.materials}
+    nmaterials = max(names) + 1
+    index = Model.materialField.data[:, 0]
+    melt = Model.meltField.data[:, 0]
+    local = np.zeros((3, nmaterials))
+    local[0] = np.bincount(index, weights=melt, minlength=nmaterials)
+    local[1] = np.bincount(index, minlength=nmaterials)
+    local[2] = np.bincount(index, weights=melt > 0., minlength=nmaterials)
+    total = np.empty_like(local)
+    comm.Allreduce(local, total, op=MPI.SUM)
+    scalars = {}
+    for i, name in names.items():
+        if total[1, i]:
+            scalars["mean melt fraction " + name] = total[0, i] / total[1, i]
+            scalars["molten particles " + name] = int(total[2, i])
+    return {"scalars": scalars, "profiles": {}}
+
+
+@diagnostic("max strain rate")
+def max_strain_rate(Model, spec, comm):
+    from rift_model import GEO, u
+    local = np.max(Model.strainRate_2ndInvariant.evaluate(Model.mesh), initial=0.)
+    value = comm.allreduce(float(local), op=MPI.MAX)
+    return {"scalars": {"max strain rate (1/s)": GEO.dimensionalise(value, 1. / u.second).magnitude},
+            "profiles": {}}
+
+
+def element_areas(mesh):
+    """Area of every local element of a Q1 mesh, also valid once the mesh is deformed."""
+    corners = mesh.data[mesh.data_elementNodes[:, [0, 1, 3, 2]]]
+    x, y = corners[..., 0], corners[..., 1]
+    return 0.5 * np.abs(np.sum(x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y, axis=1))
+
+
+@diagnostic("sediment volume")
+def sediment_volume(Model, spec, comm):
+    """Area (km^2, i.e. volume per metre along strike) of deposited sediment,
+    from the fraction of each element's particles that are sediment."""
+    from rift_model import GEO, u
+    sediment = [Model.materials_by_name[name].index for name in spec["surfaceProcesses"]["sediment"]]
+    cells = Model.swarm.owningCell.data[:, 0]
+    nelements = len(Model.mesh.data_elementNodes)
+    isSediment = np.isin(Model.materialField.data[:, 0], sediment)
+    particles = np.bincount(cells, minlength=nelements)
+    sedimentParticles = np.bincount(cells, weights=isSediment, minlength=nelements)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.where(particles > 0, sedimentParticles / particles, 0.)
+    area = comm.allreduce(float(np.sum(fraction * element_areas(Model.mesh))), op=MPI.SUM)
+    return {"scalars": {"sediment volume (km^2)": GEO.dimensionalise(area, u.kilometer**2).magnitude},
+            "profiles": {}}
+
+
+def truncate_jsonl(path, time):
+    """Drop the records of the JSON lines file path after time, and a last line
+    cut short by a crash."""
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        lines = [line for line in f if line.endswith("\n") and json.loads(line)["time"] <= time]
+    with open(path + ".tmp", "w") as f:
+        f.writelines(lines)
+    os.replace(path + ".tmp", path)
+
+
+def truncate_rows(path, time):
+    """Drop the rows of the datasets of path (appended by append_row along with
+    a "time" dataset) after time."""
+    if not os.path.exists(path):
+        return
+    with h5py.File(path, "a") as f:
+        if "time" not in f:
+            return
+        keep = int(np.searchsorted(f["time"][...], time, side="right"))
+        for ds in f.values():
+            if ds.shape[0] > keep:
+                ds.resize(keep, axis=0)
+
+
+class DiagnosticsHook(object):
+    """Post-solve hook evaluating the diagnostics of spec["diagnostics"] at their cadence.
+
+    The cadence counts from the model time of the first pre-solve, after
+    Model.run_for has restarted the model.
+    """
+
+    def __init__(self, Model, spec, comm):
+        from rift_model import _q
+        self.Model = Model
+        self.spec = spec
+        self.comm = comm
+        options = spec["diagnostics"]
+        self.names = options["names"]
+        self.every = _q(options["every"]).to("year").magnitude
+        self.start = None
+        self.next = None
+        Model.pre_solve_functions["Diagnostics"] = self.start_run
+
+    def start_run(self):
+        """Drop what a previous run wrote past the restart time, once."""
+        from rift_model import model_time
+        if self.start is not None:
+            return
+        self.start = model_time(self.Model)
+        self.next = (self.start // self.every + 1) * self.every
+        if self.comm.rank == 0:
+            truncate_jsonl(os.path.join(self.Model.outputDir, "diagnostics.jsonl"), self.start)
+            truncate_rows(os.path.join(self.Model.outputDir, "diagnostics.h5"), self.start)
+
+    def __call__(self):
+        from rift_model import model_time
+        time = model_time(self.Model)
+        if time < self.next:
+            return
+        self.next = (time // self.every + 1) * self.every
+        self.write(time)
+    def write(self, time):
+        results = [DIAGNOSTICS[name](self.Model, self.spec, self.comm) for name in self.names]
+        if self.comm.rank != 0:
+            return
+
+        record = {"step": int(self.Model.step), "time": time}
+        for result in results:
+            record.update(result["scalars"])
+        with open(os.path.join(self.Model.outputDir, "diagnostics.jsonl"), "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+        profiles = {name: values for result in results for name, values in result["profiles"].items()}
+        if profiles:
+            with h5py.File(os.path.join(self.Model.outputDir, "diagnostics.h5"), "a") as f:
+                append_row(f, "time", time)
+                append_row(f, "step", int(self.Model.step))
+                for name, values in profiles.items():
+                    append_row(f, name, values, dtype=np.float32)
@@ -0,0 +1,154 @@
+# Steady-state geotherm of a layered model.
+#
+# The layers are laterally uniform and the side walls are insulating, so the
+# initial steady-state temperature only varies with depth. layered_geotherm()
+# solves d/dy(kappa dT/dy) + H / (rho c) = 0 in 1-D on the mesh's own node rows,
+# with the diffusivity, capacity, density and radiogenic heat of the layer table,
+# the top and bottom temperatures and the fixed-temperature node sets (the air),
+# and holds limited materials at their temperatureLimiter. The profile is cached
+# per spec next to the initialised states and copied onto every mesh node,
+# instead of solving the steady-state heat equation on the 2-D mesh.
+#Written by Youseph Ibrahim
+
+import json
+import os
+
+import numpy as np
+
+
+def _layers(spec):
+    """(bottom, top, params) in m of every layered material, in assignment order."""
+    from rift_model import _q
+    layers = []
+    for params in spec["materials"]:
+        if params.get("shape") is False:
+            continue
+        bottom = -np.inf if params["bottom"] is None else _q(params["bottom"]).to("metre").magnitude
+        top = np.inf if params["top"] is None else _q(params["top"]).to("metre").magnitude
+        layers.append((bottom, top, params))
+    return layers
+
+
+def _material_at(layers, y):
+    """Index into layers of the material at each height y, the last assigned wins."""
+    index = np.full(len(y), -1)
+    for i, (bottom, top, _) in enumerate(layers):
+        index[(y >= bottom) & (y <= top)] = i
+    return index
+
+
+def node_heights(spec):
+    """Heights (m) of the mesh node rows of spec."""
+    from rift_mesh import mesh_axes
+    from rift_model import _q
+    nodes = mesh_axes(spec)[1]
+    if nodes is not None:
+        return nodes * 1e3
+    low, high = [_q(value).to("metre").magnitude for value in (spec["minCoord"][1], spec["maxCoord"][1])]
+    return np.linspace(low, high, spec["resolution"][1] + 1)
+
+
+def layered_geotherm(spec):
+    """Node heights (m) and steady-state temperatures (K) of spec."""
+    from rift_model import _q
+    y = node_heights(spec)
+    layers = _layers(spec)
+
+    #Cell properties, taken at the cell centres
+    h = np.diff(y)
+    cell = _material_at(layers, 0.5 * (y[1:] + y[:-1]))
+    kappa = np.empty(len(h))
+    source = np.empty(len(h))
+    for i, (_, _, params) in enumerate(layers):
+        mask = cell == i
+        diffusivity = _q(params.get("diffusivity") or spec["diffusivity"]).to("metre**2 / second").magnitude
+        capacity = _q(params.get("capacity") or spec["capacity"]).to("joule / (kelvin * kilogram)").magnitude
+        density = _q(params["density"]).to("kilogram / metre**3").magnitude
+        heat = params.get("radiogenicHeatProd")
+        heat = 0. if heat is None else _q(heat).to("watt / metre**3").magnitude
+        kappa[mask] = diffusivity
+        source[mask] = heat / (density * capacity)
+
+    #Fixed temperatures: the boundaries and the node sets
+    bcs = spec["temperatureBCs"]
+    fixed = np.full(len(y), np.nan)
+    fixed[-1] = _q(bcs["top"]).to("kelvin").magnitude
+    fixed[0] = _q(bcs["bottom"]).to("kelvin").magnitude
+    bounds = {params["name"]: (bottom, top) for bottom, top, params in layers}
+    for name, temperature in bcs.get("nodeSets", ()):
+        bottom, top = bounds[name]
+        fixed[(y >= bottom) & (y <= top)] = _q(temperature).to("kelvin").magnitude
+
+    nodeMaterial = _material_at(layers, y)
+
+    limit = np.full(len(y), np.inf)
+    for i, (_, _, params) in enumerate(layers):
+        if params.get("temperatureLimiter") is not None:
+            limit[nodeMaterial == i] = _q(params["temperatureLimiter"]).to("kelvin").magnitude
+
+    return y, steady_profile(y, kappa, source, fixed, limit)
+
+
+def steady_profile(y, kappa, source, fixed, limit=None):
+    """Nodal solution of d/dy(kappa dT/dy) + source = 0 on the node heights y.
+
+    kappa and source are given per cell, fixed per node (NaN where the node is
+    free) and limit, if given, per node: free nodes that end up above their limit
+    are held at it and the profile solved again until none is.
+    """
+    #Finite volumes around the nodes, the same equations as linear elements
+    #with piecewise constant coefficients
+    h = np.diff(y)
+    fixed = np.array(fixed, dtype=np.float64)
+    limit = np.full(len(y), np.inf) if limit is None else limit
+    conductance = kappa / h
+    while True:
+        A = np.zeros((len(y), len(y)))
+        b = np.zeros(len(y))
+        i = np.arange(len(h))
+        A[i, i] -= conductance
+        A[i, i + 1] += conductance
+        A[i + 1, i + 1] -= conductance
+        A[i + 1, i] += conductance
+        b[:-1] -= 0.5 * h * source
+        b[1:] -= 0.5 * h * source
+        held = ~np.isnan(fixed)
+        A[held] = 0.
+        A[held, held] = 1.
+        b[held] = fixed[held]
+        temperature = np.linalg.solve(A, b)
+        hot = ~held & (temperature > limit + 1e-9)
+        if not hot.any():
+            return temperature
+        fixed[hot] = limit[hot]
+
+
+def geotherm_path(spec):
+    from rift_model import INIT_INDEPENDENT_KEYS, spec_hash
+    return os.path.join(spec["initCache"], "geotherm-{0}.json".format(spec_hash(spec, exclude=INIT_INDEPENDENT_KEYS)))
+
+
+def cached_geotherm(spec):
+    """layered_geotherm(spec), read from and written to the init cache if there is one."""
+    if not spec.get("initCache"):
+        return layered_geotherm(spec)
+    path = geotherm_path(spec)
+    if os.path.exists(path):
+        with open(path) as f:
+            profile = json.load(f)
+        return np.array(profile["y"]), np.array(profile["temperature"])
+    y, temperature = layered_geotherm(spec)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"y": y.tolist(), "temperature": temperature.tolist()}, f)
+    os.replace(path + ".tmp", path)
+    return y, temperature
+
+
+def apply_geotherm(Model, spec):
+    """Set the temperature of every node of Model from the layered geotherm of spec."""
+    from rift_model import GEO, u
+    y, temperature = cached_geotherm(spec)
+    heights = GEO.dimensionalise(Model.mesh.data[:, 1], u.metre).magnitude
+    values = np.interp(heights, y, temperature)
+    Model.temperature.data[:, 0] = GEO.nd(values * u.kelvin)
@@ -0,0 +1,32 @@
+# Material index of particles in a stack of horizontal layers.
+#
+# One searchsorted over the sorted layer bottoms instead of testing every
+# particle against every shape. Plain NumPy, see rift_model.assign_layers for
+# how it is applied to a model.
+#Written by Youseph Ibrahim
+
+import numpy as np
+
+
+def layer_indices(layers, y):
+    """Material index at every height y, -1 outside every layer.
+
+    layers are (bottom, top, index) of non overlapping layers, in any order. A
+    height on the boundary between two layers goes to the lower one, which is
+    also the one that is added last.
+    """
+    layers = sorted(layers, key=lambda layer: layer[0])
+    bottoms = np.array([layer[0] for layer in layers])
+    tops = np.array([layer[1] for layer in layers])
+    indices = np.array([layer[2] for layer in layers])
+
+    #The lower layer of a boundary first, then the layer a height is the bottom of,
+    #for the bottom of the stack and for layers with a gap below them
+    result = np.full(len(y), -1)
+    for side in ("left", "right"):
+        k = np.searchsorted(bottoms, y, side=side) - 1
+        inside = (k >= 0) & (result < 0)
+        k[~inside] = 0
+        inside &= y <= tops[k]
+        result[inside] = indices[k[inside]]
+    return result
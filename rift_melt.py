@@ -0,0 +1,159 @@
+# Tabulated melt fraction.
+#
+# The melt modifiers evaluate polynomial solidus/liquidus curves and the
+# McKenzie & Bickle (1988) melt fraction on every particle every step. MeltTable
+# precomputes them for one melt modifier: the solidus and liquidus on a pressure
+# grid and the melt fraction (capped at meltFractionLimit) on a grid of the
+# reduced temperature (T - Ts) / (Tl - Ts). A lookup is then two linear
+# interpolations on uniform grids. Each grid is refined until the interpolation
+# error, measured half way between the nodes, is within tolerance, and the
+# errors are reported when the tables are built.
+#
+# use_melt_tables() replaces Model.update_melt_fraction with table lookups that
+# write the equilibrium melt fraction straight into meltField. The viscosity
+# change of the melt modifiers is still applied by UWGeodynamics from meltField.
+# UWGeodynamics' own update only melts between the solidus and the liquidus and
+# gives 0 above the liquidus; the tables clamp the reduced temperature to [0, 1],
+# so above the liquidus they give meltFractionLimit.
+#Written by Youseph Ibrahim
+
+import numpy as np
+
+
+def polynomial(coefficients, pressure):
+    """A1 + A2 P + A3 P^2 + A4 P^3, in K with P in Pa."""
+    result = np.zeros_like(pressure, dtype=np.float64)
+    for coefficient in reversed(coefficients):
+        result = result * pressure + coefficient
+    return result
+
+
+def melt_fraction(reduced):
+    """McKenzie & Bickle (1988) melt fraction of the reduced temperature
+    (T - Ts) / (Tl - Ts), between 0 and 1."""
+    t = reduced - 0.5
+    return np.clip(0.5 + t + (t * t - 0.25) * (0.4256 + 2.988 * t), 0., 1.)
+
+
+class Table1D(object):
+    """function sampled on a uniform grid over [low, high], refined by doubling until
+    linear interpolation is within tolerance of it half way between the nodes.
+    Arguments outside [low, high] are clamped."""
+
+    def __init__(self, function, low, high, tolerance, nodes=256, maxNodes=1 << 20):
+        self.low = low
+        while True:
+            x = np.linspace(low, high, nodes)
+            self.values = function(x)
+            self.step = x[1] - x[0]
+            middle = 0.5 * (x[1:] + x[:-1])
+            self.error = float(np.max(np.abs(self(middle) - function(middle)), initial=0.))
+            if self.error <= tolerance or 2 * nodes > maxNodes:
+                break
+            nodes *= 2
+
+    def __call__(self, x):
+        position = np.clip((np.asarray(x) - self.low) / self.step, 0., len(self.values) - 1.)
+        i = np.minimum(position.astype(np.intp), len(self.values) - 2)
+        weight = position - i
+        return (1. - weight) * self.values[i] + weight * self.values[i + 1]
+
+
+class MeltTable(object):
+    """Solidus, liquidus and melt fraction tables of one melt modifier.
+
+    solidus and liquidus are the polynomial coefficients in SI units, modifier the
+    melt entry of a material spec. Pressures are in Pa and temperatures in K.
+    """
+
+    def __init__(self, solidus, liquidus, modifier, pressureRange, temperatureTolerance=1e-2, tolerance=1e-4):
+        self.solidus = Table1D(lambda p: polynomial(solidus, p), pressureRange[0], pressureRange[1],
+                               temperatureTolerance)
+        self.liquidus = Table1D(lambda p: polynomial(liquidus, p), pressureRange[0], pressureRange[1],
+                                temperatureTolerance)
+        limit = modifier["meltFractionLimit"]
+        self.fraction = Table1D(lambda r: np.minimum(melt_fraction(r), limit), 0., 1., tolerance)
+
+    def reduced(self, pressure, temperature):
+        solidus = self.solidus(pressure)
+        return (temperature - solidus) / (self.liquidus(pressure) - solidus)
+
+    def lookup(self, pressure, temperature):
+        """Melt fraction at pressure and temperature."""
+        return self.fraction(self.reduced(pressure, temperature))
+
+    def report(self):
+        return ("solidus/liquidus {0}/{1} nodes, max error {2:.1e}/{3:.1e} K; melt fraction {4} nodes, "
+                "max error {5:.1e}".format(
+                    len(self.solidus.values), len(self.liquidus.values), self.solidus.error, self.liquidus.error,
+                    len(self.fraction.values), self.fraction.error))
+
+
+def curve_coefficients(curve):
+    """A1..A4 of a GEO.Solidus / GEO.Liquidus in SI units."""
+    from rift_model import u
+    units = [u.kelvin, u.kelvin / u.pascal, u.kelvin / u.pascal**2, u.kelvin / u.pascal**3]
+    return [getattr(curve, "A{0}".format(i + 1)).to(unit).magnitude for i, unit in enumerate(units)]
+
+
+def build_melt_tables(spec):
+    """One MeltTable per distinct melt modifier of spec, keyed by material name."""
+    from rift_model import _q, _melt_curve, spec_hash
+    options = spec["meltTables"]
+    pressureRange = [_q(value).to("pascal").magnitude for value in options["pressureRange"]]
+    temperatureTolerance = _q(options["temperatureTolerance"]).to("kelvin").magnitude
+    tables = {}
+    byMaterial = {}
+    for params in spec["materials"]:
+        melt = params.get("melt")
+        if not melt:
+            continue
+        key = spec_hash({"melt": melt})
+        if key not in tables:
+            tables[key] = MeltTable(curve_coefficients(_melt_curve(spec, melt["solidus"])),
+                                    curve_coefficients(_melt_curve(spec, melt["liquidus"])),
+                                    melt, pressureRange, temperatureTolerance, options["tolerance"])
+        byMaterial[params["name"]] = tables[key]
+    return byMaterial
+
+
+def _by_table(tables):
+    """(table, material names) for every distinct table."""
+    groups = {}
+    for name, table in tables.items():
+        groups.setdefault(id(table), (table, []))[1].append(name)
+    return list(groups.values())
+
+
+class TabulatedMelt(object):
+    """Melt fraction update of Model from melt tables instead of the polynomial curves."""
+
+    def __init__(self, Model, tables):
+        self.Model = Model
+        self.tables = [(table, [Model.materials_by_name[name].index for name in names])
+                       for table, names in _by_table(tables)]
+
+    def __call__(self, *args, **kwargs):
+        from rift_model import GEO, u
+        Model = self.Model
+        pressure = GEO.dimensionalise(Model.pressureField.evaluate(Model.swarm)[:, 0], u.pascal).magnitude
+        temperature = GEO.dimensionalise(Model.temperature.evaluate(Model.swarm)[:, 0], u.kelvin).magnitude
+        index = Model.materialField.data[:, 0]
+        for table, indices in self.tables:
+            mask = np.isin(index, indices)
+            if mask.any():
+                Model.meltField.data[mask, 0] = table.lookup(pressure[mask], temperature[mask])
+
+
+def use_melt_tables(Model, spec):
+    """Build the melt tables of spec, report their accuracy and make Model use them."""
+    import underworld as uw
+    tables = build_melt_tables(spec)
+    if uw.mpi.rank == 0:
+        for table, names in _by_table(tables):
+            print("Melt tables for {0}: {1}".format(", ".join(names), table.report()))
+    #The melt fraction update of UWGeodynamics 2.13
+    if not callable(getattr(Model, "update_melt_fraction", None)):
+        raise AttributeError("Model has no update_melt_fraction, the melt tables need UWGeodynamics 2.13")
+    Model.update_melt_fraction = TabulatedMelt(Model, tables)
+    return tables
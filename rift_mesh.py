@@ -0,0 +1,107 @@
+# Graded meshes.
+#
+# spec["meshRefinement"] gives, per axis, an interval meshed uniformly at the
+# fine element size, e.g. around the damage centre and over the crust. Away from
+# it the elements grow geometrically up to a maximum size towards the walls and
+# the base. The element counts follow from the grading, so spec["resolution"] is
+# not used for a refined axis. The mesh is built uniform with those counts and
+# its nodes are then moved onto the graded coordinates, axis by axis, before any
+# material is assigned, and the swarm is laid out again over the new elements.
+#Written by Youseph Ibrahim
+
+import numpy as np
+
+AXES = ("x", "y")
+
+
+def _growing(distance, size, growth, maxSize):
+    """Element sizes starting at size, growing by growth up to maxSize, scaled to
+    add up to distance exactly."""
+    sizes = []
+    total = 0.
+    while total < distance:
+        size = min(size * growth, maxSize)
+        sizes.append(size)
+        total += size
+    if not sizes:
+        return np.zeros(0)
+    sizes = np.array(sizes)
+    #Drop the last element if that gets closer to the fine size than stretching
+    if len(sizes) > 1 and total - distance > 0.5 * sizes[-1]:
+        sizes = sizes[:-1]
+    return sizes * (distance / sizes.sum())
+
+
+def graded_nodes(low, high, fine, size, growth, maxSize):
+    """Node coordinates of one axis over [low, high], uniform at about size in the
+    interval fine and growing by growth (up to maxSize) on either side of it."""
+    start, end = max(fine[0], low), min(fine[1], high)
+    count = max(int(round((end - start) / size)), 1)
+    middle = np.linspace(start, end, count + 1)
+    below = start - np.cumsum(_growing(start - low, size, growth, maxSize))[::-1]
+    above = end + np.cumsum(_growing(high - end, size, growth, maxSize))
+    nodes = np.concatenate([below, middle, above])
+    nodes[0], nodes[-1] = low, high
+    return nodes
+
+
+def mesh_axes(spec):
+    """Graded node coordinates (in km) of every refined axis of spec, None for uniform axes."""
+    from rift_model import _q
+    refinement = spec.get("meshRefinement") or {}
+    axes = []
+    for axis, name in enumerate(AXES):
+        params = refinement.get(name)
+        if not params:
+            axes.append(None)
+            continue
+        km = lambda value: _q(value).to("kilometer").magnitude
+        axes.append(graded_nodes(km(spec["minCoord"][axis]), km(spec["maxCoord"][axis]),
+                                 [km(value) for value in params["fine"]], km(params["size"]),
+                                 params["growth"], km(params["maxSize"])))
+    return axes
+
+
+def mesh_resolution(spec, axes=None):
+    """Element counts of the (possibly graded) mesh of spec."""
+    axes = mesh_axes(spec) if axes is None else axes
+    return tuple(res if nodes is None else len(nodes) - 1 for res, nodes in zip(spec["resolution"], axes))
+
+
+def grade_mesh(Model, axes):
+    """Move the nodes of Model's uniform mesh onto the graded coordinates (km)."""
+    from rift_model import GEO, u
+    mesh = Model.mesh
+    with mesh.deform_mesh():
+        for axis, nodes in enumerate(axes):
+            if nodes is None:
+                continue
+            low, high = GEO.nd(Model.minCoord[axis]), GEO.nd(Model.maxCoord[axis])
+            index = np.rint((mesh.data[:, axis] - low) * ((len(nodes) - 1) / (high - low))).astype(int)
+            mesh.data[:, axis] = GEO.nd(nodes[index] * u.kilometer)
+
+
+def element_particles(mesh, perSide):
+    """perSide x perSide particles per local element of a (deformed) Q1 mesh."""
+    s = (np.arange(perSide) + 0.5) / perSide
+    S, T = [a.ravel() for a in np.meshgrid(s, s, indexing="ij")]
+    weights = np.stack([(1. - S) * (1. - T), S * (1. - T), (1. - S) * T, S * T])
+    corners = mesh.data[mesh.data_elementNodes]
+    return np.einsum("kp,ekd->epd", weights, corners).reshape(-1, 2)
+
+
+def particles_per_side(Model):
+    """Square root of the mean number of particles per local element, rounded."""
+    return max(int(round(np.sqrt(Model.swarm.particleLocalCount / len(Model.mesh.data_elementNodes)))), 1)
+
+
+def relayout_swarm(Model):
+    """Replace the particles laid out on the uniform mesh by the same number per
+    element of the graded one. Only valid before any swarm variable is set."""
+    from rift_state import OUTSIDE
+    swarm = Model.swarm
+    perSide = particles_per_side(Model)
+    with swarm.deform_swarm():
+        swarm.data[:] = OUTSIDE
+    swarm.update_particle_owners()
+    swarm.add_particles_with_coordinates(np.ascontiguousarray(element_particles(Model.mesh, perSide)))
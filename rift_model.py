@@ -0,0 +1,894 @@
+# Shared model specification for the narrow and wide rift inversion models.
+# Narrow_Rift.py and Wide_Rift.py are both built from rift_spec() below, so the
+# layering, rheology, plasticity, melt modifiers, BCs and tracers live in one place.
+#Written by Youseph Ibrahim
+
+import copy
+import hashlib
+import json
+import os
+
+import numpy as np
+import underworld as uw
+from underworld import UWGeodynamics as GEO
+from underworld.UWGeodynamics.surfaceProcesses import SedimentationThreshold
+
+from rift_damage import damage_field
+from rift_diagnostics import DiagnosticsHook
+from rift_geotherm import apply_geotherm
+from rift_layers import layer_indices
+from rift_melt import use_melt_tables
+from rift_mesh import grade_mesh, mesh_axes, mesh_resolution, relayout_swarm
+from rift_nonlinear import NonlinearStrategy
+from rift_output import (AsyncCheckpointWriter, CheckpointHook, OutputSchedule, TracerIds, add_tracer_ids,
+                         checkpoint_fields, checkpoint_time, complete_checkpoints, load_checkpoint,
+                         tag_tracers)
+from rift_post import iter_checkpoints
+from rift_solver import PreconditionerReuse, load_profile, merge_options, set_reuse_options
+from rift_surface import BandedSedimentation, FreeSurfaceSedimentation
+from rift_state import snapshot_state, restore_state, save_state, load_state
+from rift_thermal import LaggedThermalSolve
+from rift_timestep import TimeStepController
+from rift_timing import StepTimer
+from rift_variants import OUTPUT_DIRS, VARIANTS
+from rift_warmstart import warm_start
+
+u = GEO.UnitRegistry
+
+#Fields of the full checkpoints before spec["outputs"]["dropFields"] is applied
+DEFAULT_OUTPUTS = list(GEO.rcParams["default.outputs"])
+
+#Model solver parameters
+RC_PARAMS = {
+    "initial.nonlinear.tolerance": 1e-3,
+    "nonlinear.tolerance": 5e-4,
+    "nonlinear.min.iterations": 1,
+    "nonlinear.max.iterations": 100,
+    "CFL": 0.1,
+    "advection.diffusion.method": "SLCN",
+    "shear.heating": True,
+    "surface.pressure.normalization": True,  # Make sure the top of the model is approximately 0 Pa
+    "popcontrol.split.threshold": 0.95,
+    "popcontrol.max.splits": 100,
+}
+
+#Quantities are stored as (magnitude, units) pairs so a spec is plain JSON and can be hashed
+WET_QUARTZ = "Wet_Quartz_Dislocation_Paterson_and_Luan_1990"
+DRY_OLIVINE = "Dry_Olivine_Dislocation_Karato_and_Wu_1993"
+THERMAL_EXPANSIVITY = (2.8e-5, "kelvin**-1")
+
+def _drucker_prager(cohesion, cohesionAfterSoftening, frictionCoefficient,
+                    frictionAfterSoftening, epsilon1, epsilon2, name="Continental Crust"):
+    return {"name": name,
+            "cohesion": (cohesion, "megapascal"),
+            "cohesionAfterSoftening": (cohesionAfterSoftening, "megapascal"),
+            "frictionCoefficient": frictionCoefficient,
+            "frictionAfterSoftening": frictionAfterSoftening,
+            "epsilon1": epsilon1, "epsilon2": epsilon2}
+
+SEDIMENT1_PLASTICITY = _drucker_prager(0., 0., 0.1, 0.01, 0.0, 0.15)
+UPPER_CRUST_PLASTICITY = _drucker_prager(5., 1., 0.54, 0.011, 0.0, 0.15)
+CRUST_PLASTICITY = _drucker_prager(15., 1.5, 0.54, 0.011, 0.0, 0.25)
+MANTLE_PLASTICITY = _drucker_prager(15., 1.5, 0.44, 0.011, 0.0, 0.15)
+DEPOSITED_SEDIMENT_PLASTICITY = _drucker_prager(1.0, 0.1, 0.4, 0.01, 0.05, 0.15, name=None)
+
+#Solidus and liquidus curves, either polynomial coefficients or a registry entry name
+MELT_CURVES = {
+    "crust_solidus": {"A1": (923, "kelvin"), "A2": (-1.2e-07, "kelvin / pascal"),
+                      "A3": (1.2e-16, "kelvin / pascal**2"), "A4": (0.0, "kelvin / pascal**3")},
+    "crust_liquidus": {"A1": (1423, "kelvin"), "A2": (-1.2e-07, "kelvin / pascal"),
+                       "A3": (1.6e-16, "kelvin / pascal**2"), "A4": (0.0, "kelvin / pascal**3")},
+    "mantle_solidus": "Mantle_Solidus",
+    "mantle_liquidus": "Mantle_Liquidus",
+}
+
+CRUST_MELT = {"solidus": "crust_solidus", "liquidus": "crust_liquidus",
+              "latentHeatFusion": (250.0, "kilojoules / kilogram / kelvin"),
+              "meltFraction": 0., "meltFractionLimit": 0.3, "meltExpansion": 0.13,
+              "viscosityChangeX1": 0.15, "viscosityChangeX2": 0.30, "viscosityChange": 1e-3}
+
+MANTLE_MELT = {"solidus": "mantle_solidus", "liquidus": "mantle_liquidus",
+               "latentHeatFusion": (250.0, "kilojoules / kilogram / kelvin"),
+               "meltFraction": 0., "meltFractionLimit": 0.03, "meltExpansion": 0.13,
+               "viscosityChangeX1": 0.001, "viscosityChangeX2": 0.03, "viscosityChange": 1e-2}
+
+#750 m elements around the damage centre and over the crust, growing to 3 km
+#towards the walls and the base: 506 x 162 instead of 960 x 320 elements
+GRADED_MESH = {"x": {"fine": [(240., "kilometer"), (480., "kilometer")], "size": (0.75, "kilometer"),
+                     "growth": 1.05, "maxSize": (3., "kilometer")},
+               "y": {"fine": [(-40., "kilometer"), (30., "kilometer")], "size": (0.75, "kilometer"),
+                     "growth": 1.05, "maxSize": (3., "kilometer")}}
+
+#Grow the CFL factor by 20% after quiet steps, halve it when the nonlinear solve
+#struggles or the peak strain rate jumps, never above 0.5 or dt above 50 kyr
+TIME_STEP_CONTROL = {"minCFL": 0.025, "maxCFL": 0.5, "maxDt": (50000., "year"),
+                     "grow": 1.2, "shrink": 0.5, "lowIterations": 3, "highIterations": 20,
+                     "quietChange": 0.05, "localisationChange": 0.25}
+
+#Loosen the nonlinear tolerance by 1.5x per quiet step up to 2e-3, and Anderson
+#accelerate the Picard iterations once they change the solution by less than 1%
+NONLINEAR_STRATEGY = {"maxTolerance": 2e-3, "loosen": 1.5, "quietChange": 1e-3,
+                      "anderson": {"depth": 5, "start": 1e-2}}
+
+#Advance the temperature every 5 steps, or sooner if it would change by 2 K
+THERMAL_LAG = {"every": 5, "maxChange": (2., "kelvin")}
+
+#Restart snapshots every 20 kyr between the HDF5 checkpoints, written in the
+#background (see rift_output.py)
+ASYNC_CHECKPOINTS = {"every": (20000., "year")}
+
+#First 300 kyr on a mesh twice as coarse, see rift_warmstart.py
+WARM_START = {"factor": 2, "duration": (300000., "year")}
+
+#Melt fraction from precomputed tables instead of the polynomial curves (see rift_melt.py),
+#e.g. variant(NARROW_RIFT, meltTables=MELT_TABLES)
+MELT_TABLES = {"pressureRange": [(0., "gigapascal"), (10., "gigapascal")],
+               "temperatureTolerance": (0.01, "kelvin"), "tolerance": 1e-4}
+
+
+def rift_spec(name, outputDir, radiogenicHeatProd, lithosphereBase, duration,
+              crustL3Density=2650.):
+    """Layered model specification shared by the rift variants.
+
+    radiogenicHeatProd is in W/m^3, lithosphereBase (the upper mantle /
+    asthenosphere boundary) in km and duration in years.
+    """
+    heat = (radiogenicHeatProd, "watt / meter**3")
+
+    def layer(layerName, top, bottom, density, viscosity, plasticity=None,
+              stressLimiter=None, melt=None):
+        return {"name": layerName,
+                "top": None if top is None else (top, "kilometer"),
+                "bottom": None if bottom is None else (bottom, "kilometer"),
+                "density": (density, "kilogram / metre**3"),
+                "thermalExpansivity": THERMAL_EXPANSIVITY,
+                "radiogenicHeatProd": heat,
+                "viscosity": viscosity,
+                "plasticity": plasticity,
+                "stressLimiter": None if stressLimiter is None else (stressLimiter, "megapascal"),
+                "melt": melt}
+
+    materials = []
+
+    #sticky air
+    materials.append({"name": "Air", "top": None, "bottom": (0., "kilometer"),
+                      "density": (1., "kilogram / metre**3"),
+                      "diffusivity": (1e-5, "metre**2 / second"),
+                      "capacity": (100., "joule / (kelvin * kilogram)"),
+                      "compressibility": 1.e4,
+                      "viscosity": (5e18, "pascal * second")})
+
+    #sediments, the deposited sediment has no initial shape.
+    #Its heat production has always been given in microwatt, keep it that way.
+    sediment = layer("Sediment", None, None, 2300., {"law": "Wet_Quartz_Dislocation_Gleason_and_Tullis_1995"},
+                     DEPOSITED_SEDIMENT_PLASTICITY, 100)
+    sediment["radiogenicHeatProd"] = (radiogenicHeatProd, "microwatt / meter**3")
+    sediment["shape"] = False
+    materials.append(sediment)
+
+    materials.append(layer("Sediment Layer 1", 0., -1., 2600., (5e19, "pascal * second"),
+                           SEDIMENT1_PLASTICITY, 100))
+    for i in range(2, 7):
+        materials.append(layer("Sediment Layer %d" % i, -(i - 1.), -float(i), 2600.,
+                               {"law": WET_QUARTZ, "factor": 0.01}, UPPER_CRUST_PLASTICITY, 100))
+
+    #Continental Crust
+    materials.append(layer("Continental Crust Layer3", -6., -9., crustL3Density,
+                           {"law": WET_QUARTZ, "factor": 0.75}, UPPER_CRUST_PLASTICITY, 125, CRUST_MELT))
+    crust = [(4, -9., -12., 2675., 0.25),
+             (5, -12., -15., 2700., 1),
+             (6, -15., -18., 2725., 1),
+             (7, -18., -21., 2750., 2),
+             (8, -21., -24., 2775., 2),
+             (9, -24., -27., 2800., 3),
+             (10, -27., -36., 2825., 3)]
+    for i, top, bottom, density, factor in crust:
+        materials.append(layer("Continental Crust Layer%d" % i, top, bottom, density,
+                               {"law": WET_QUARTZ, "factor": factor}, CRUST_PLASTICITY, 150, CRUST_MELT))
+
+    #Mantle
+    for mantleName, top, bottom in [("Upper Mantle", -36., lithosphereBase),
+                                    ("Asthenosphere", lithosphereBase, None)]:
+        mantle = layer(mantleName, top, bottom, 3370., {"law": DRY_OLIVINE},
+                       MANTLE_PLASTICITY, 250, MANTLE_MELT)
+        del mantle["radiogenicHeatProd"]
+        mantle["temperatureLimiter"] = (1603., "kelvin")
+        materials.append(mantle)
+
+    return {
+        "name": name,
+        "outputDir": outputDir,
+        "rcParams": dict(RC_PARAMS),
+        "resolution": [960, 320],  #750 m resolution
+        #Uniform mesh, GRADED_MESH (see rift_mesh.py) keeps 750 m only where strain localises
+        "meshRefinement": None,
+        "minCoord": [(0., "kilometer"), (-210., "kilometer")],
+        "maxCoord": [(720., "kilometer"), (30., "kilometer")],
+        "gravity": (9.81, "meter / second**2"),
+        #Model Scaling
+        "scaling": {"half_rate": (18, "millimeter / year"),
+                    "model_length": (720e3, "meter"),
+                    "surfaceTemp": (293.15, "degK"),
+                    "baseModelTemp": (1603.15, "degK"),
+                    "reference_density": (3150, "kilogram / metre**3")},
+        "diffusivity": (9e-7, "metre**2 / second"),
+        "capacity": (1000., "joule / (kelvin * kilogram)"),
+        "minViscosity": (1e18, "pascal * second"),
+        "maxViscosity": (5e23, "pascal * second"),
+        "meltCurves": MELT_CURVES,
+        "materials": materials,
+        "temperatureBCs": {"top": (293.15, "degK"), "bottom": (1603.15, "degK"),
+                           "nodeSets": [("Air", (293.15, "degK"))]},
+        #-velocity is contraction, +velocity is extension
+        "velocity": (-1.1355, "centimeter / year"),
+        #Airy-like traction basal boundary condition
+        "basalTraction": (6.48174e9, "pascal"),
+        #Gaussian damage
+        "damage": {"maxDamage": 0.25, "centre": [(360., "kilometer"), (-40., "kilometer")],
+                   "width": (75., "kilometer"), "verticalWidthFactor": 100., "seed": 1},
+        #Sediment deposition below 0 m elevation, only air within band of the threshold is tested
+        "surfaceProcesses": {"air": ["Air"], "sediment": ["Sediment"], "threshold": (0., "metre"),
+                             "band": (5., "kilometre")},
+        #Tracers for visualisation, not required for running model
+        "tracers": [
+            {"name": "Surface", "type": "line", "npoints": 1000, "y": (0., "kilometre")},
+            {"name": "Moho", "type": "line", "npoints": 1000, "y": (-36., "kilometre")},
+            {"name": "FSE_Crust", "type": "circles_grid", "radius": (1.5, "kilometer"),
+             "bottom": (-36., "kilometer"), "top": (0., "kilometer")},
+            {"name": "FSE_Mantle", "type": "circles_grid", "radius": (1.5, "kilometer"),
+             "bottom": (lithosphereBase, "kilometer"), "top": (-36., "kilometer")},
+        ],
+        "solver": {"mumpsThreshold": 1e6,
+                   "A11": {"ksp_rtol": 1e-8, "ksp_set_min_it_converge": 10, "use_previous_guess": True},
+                   "scr": {"ksp_rtol": 1e-6, "use_previous_guess": True,
+                           "ksp_set_min_it_converge": 10, "ksp_type": "cg"},
+                   "penalty": 1e5,
+                   #Keep the A11 factorisation / multigrid preconditioner between solves,
+                   #REUSE or None (see rift_solver.py)
+                   "reuse": None},
+        #Tuned solver configurations written by rift_solver.py
+        "solverProfile": "Solver_Profiles",
+        #Strain healing towards the lateral walls, applied after every solve
+        "strainTaper": {"sharpness": 20.0, "bins": 4096},
+        "duration": (duration, "years"),
+        "checkpointInterval": (100000., "year"),
+        #HDF5 checkpoints only, or ASYNC_CHECKPOINTS for restart snapshots in between
+        "asyncCheckpoints": None,
+        #Per-step timings written to <outputDir>/performance.jsonl
+        "instrumentation": True,
+        #In-situ reductions appended to <outputDir>/diagnostics.jsonl and diagnostics.h5
+        "diagnostics": {"every": (5000., "year"), "bins": 720,
+                        "names": ["surface profile", "moho profile", "melt", "max strain rate", "sediment volume"]},
+        #Outputs with their own cadence, written between checkpoints (see rift_output.py).
+        #dropFields are left out of the full checkpoints, e.g. visual-only projections
+        #such as "projViscosityField"; the scheduled outputs are compressed, the full
+        #checkpoints are written by underworld as they are.
+        "outputs": {"compression": "gzip", "compressionLevel": 4, "dropFields": [],
+                    "schedule": [{"name": "tracers", "every": (5000., "year"),
+                                  "tracers": ["Surface", "Moho", "FSE_Crust", "FSE_Mantle"]},
+                                 {"name": "temperature", "every": (20000., "year"), "fields": ["temperature"],
+                                  "float32": True}]},
+        #Initialised model states are cached here, set to None to always run init_model
+        "initCache": "Init_Cache",
+        #Tabulated melt fraction, MELT_TABLES or None for the polynomial curves
+        "meltTables": None,
+        #Sticky air above a fixed top boundary, see free_surface() for the free surface version
+        "freeSurface": False,
+        #Initial temperature from the 1-D steady state of the layers (see rift_geotherm.py)
+        #instead of the steady-state solve of Model.init_model
+        "layeredGeotherm": False,
+        #Fixed rcParams["CFL"], or TIME_STEP_CONTROL to adapt it (see rift_timestep.py)
+        "timeStepControl": None,
+        #Fixed nonlinear tolerance, or NONLINEAR_STRATEGY (see rift_nonlinear.py)
+        "nonlinearStrategy": None,
+        #Thermal solve every step, or THERMAL_LAG to lag it (see rift_thermal.py)
+        "thermalLag": None,
+        #Coarse phase to start from, WARM_START or None (see rift_warmstart.py)
+        "warmStart": None,
+    }
+
+
+NARROW_RIFT = rift_spec("Narrow_Rift", OUTPUT_DIRS["Narrow_Rift"], **VARIANTS["Narrow_Rift"])
+WIDE_RIFT = rift_spec("Wide_Rift", OUTPUT_DIRS["Wide_Rift"], **VARIANTS["Wide_Rift"])
+SPECS = {spec["name"]: spec for spec in (NARROW_RIFT, WIDE_RIFT)}
+
+
+def variant(spec, **overrides):
+    """Deep copy of a spec with top level entries replaced."""
+    new = copy.deepcopy(spec)
+    new.update(copy.deepcopy(overrides))
+    return new
+
+
+def free_surface(spec):
+    """Variant of spec without the sticky air: the domain is cut at 0 km, the
+    vertical resolution is scaled to keep the element height and the top
+    boundary becomes a free surface. Deposition fills the deformed surface
+    wherever it sinks below the sedimentation threshold."""
+    new = copy.deepcopy(spec)
+    air = new["surfaceProcesses"]["air"]
+    bottom = _q(new["minCoord"][1]).to("kilometer").magnitude
+    top = _q(new["maxCoord"][1]).to("kilometer").magnitude
+    new["resolution"][1] = int(round(new["resolution"][1] * -bottom / (top - bottom)))
+    new["maxCoord"][1] = (0., "kilometer")
+    new["materials"] = [params for params in new["materials"] if params["name"] not in air]
+    new["temperatureBCs"]["nodeSets"] = [entry for entry in new["temperatureBCs"]["nodeSets"] if entry[0] not in air]
+    new["surfaceProcesses"]["air"] = []
+    new["freeSurface"] = True
+    return new
+
+
+def spec_hash(spec, exclude=()):
+    """Stable hash of a spec, ignoring the top level keys in exclude."""
+    data = {key: value for key, value in spec.items() if key not in exclude}
+    text = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _q(value):
+    """Turn a (magnitude, units) pair from a spec into a quantity."""
+    if isinstance(value, (list, tuple)):
+        return u.Quantity(value[0], value[1])
+    return value
+
+
+def set_scaling(spec):
+    scaling = spec["scaling"]
+    half_rate = _q(scaling["half_rate"])
+    model_length = _q(scaling["model_length"])
+    surfaceTemp = _q(scaling["surfaceTemp"])
+    baseModelTemp = _q(scaling["baseModelTemp"])
+    bodyforce = _q(scaling["reference_density"]) * _q(spec["gravity"])
+
+    KL = model_length
+    Kt = KL / half_rate
+    KM = bodyforce * KL**2 * Kt**2
+    KT = (baseModelTemp - surfaceTemp)
+
+    GEO.scaling_coefficients["[length]"] = KL
+    GEO.scaling_coefficients["[time]"] = Kt
+    GEO.scaling_coefficients["[mass]"] = KM
+    GEO.scaling_coefficients["[temperature]"] = KT
+
+
+#Property objects are shared between every material and model that asks for the
+#same parameters, keyed by the hash of their part of the spec.
+_PROPERTY_CACHE = {}
+
+
+def _cached(kind, params, factory):
+    key = (kind, spec_hash({"params": params}))
+    if key not in _PROPERTY_CACHE:
+        _PROPERTY_CACHE[key] = intern_functions(factory())
+    return _PROPERTY_CACHE[key]
+
+
+#The underworld functions UWGeodynamics builds from a shared property object,
+#and the attributes of the object they depend on.
+INTERNED_FUNCTIONS = {
+    "muEff": ("pressureField", "strainRateInvariantField", "temperatureField"),
+    "_get_yield_stress": ("pressureField", "plasticStrain"),
+    "_get_yield_stress2D": ("pressureField", "plasticStrain"),
+}
+
+
+def _memoised(name, get, dependencies):
+    def memoised(self, *args):
+        key = (name, args) + tuple(id(getattr(self, attribute, None)) for attribute in dependencies)
+        functions = self.__dict__.setdefault("_interned", {})
+        if key not in functions:
+            functions[key] = get(self, *args)
+        return functions[key]
+    return memoised
+
+
+def intern_functions(obj):
+    """Make obj hand out the same function object every time UWGeodynamics asks it
+    for one of INTERNED_FUNCTIONS, as long as the fields it depends on are the same.
+
+    Materials sharing a property object (see _cached) then share one branch of the
+    viscosity and yield stress function graph instead of one branch per material.
+    """
+    cls = type(obj)
+    overrides = {}
+    for name, dependencies in INTERNED_FUNCTIONS.items():
+        attribute = getattr(cls, name, None)
+        if isinstance(attribute, property):
+            overrides[name] = property(_memoised(name, lambda self, get=attribute.fget: get(self), dependencies))
+        elif callable(attribute):
+            overrides[name] = _memoised(name, attribute, dependencies)
+    if overrides:
+        try:
+            obj.__class__ = type("Interned" + cls.__name__, (cls,), overrides)
+        except TypeError:
+            pass
+    return obj
+
+
+def rheology_groups(spec):
+    """Names of the materials of spec grouped by identical viscosity, plasticity,
+    stress limiter and melt parameters."""
+    groups = {}
+    for params in spec["materials"]:
+        key = spec_hash({key: params.get(key) for key in ("viscosity", "plasticity", "stressLimiter", "melt")})
+        groups.setdefault(key, []).append(params["name"])
+    return list(groups.values())
+
+
+def _viscosity(params):
+    if not isinstance(params, dict):
+        return _q(params)
+
+    def factory():
+        law = getattr(_cached("registry", "viscous", GEO.ViscousCreepRegistry), params["law"])
+        factor = params.get("factor")
+        return law if factor is None else factor * law
+    return _cached("viscosity", params, factory)
+
+
+def _plasticity(params):
+    def factory():
+        kwargs = {key: _q(value) for key, value in params.items() if key != "name"}
+        if params.get("name") is not None:
+            kwargs["name"] = params["name"]
+        return GEO.DruckerPrager(**kwargs)
+    return _cached("plasticity", params, factory)
+
+
+def _melt_curve(spec, curveName):
+    params = spec["meltCurves"][curveName]
+    liquidus = curveName.endswith("liquidus")
+
+    def factory():
+        if isinstance(params, str):
+            registry = GEO.LiquidusRegistry() if liquidus else GEO.SolidusRegistry()
+            return getattr(registry, params)
+        kwargs = {key: _q(value) for key, value in params.items()}
+        return GEO.Liquidus(**kwargs) if liquidus else GEO.Solidus(**kwargs)
+    return _cached("melt_curve", [curveName, params], factory)
+
+
+def _shape(Model, params):
+    if params.get("shape") is False:
+        return None
+    top = Model.top if params["top"] is None else _q(params["top"])
+    bottom = Model.bottom if params["bottom"] is None else _q(params["bottom"])
+    return GEO.shapes.Layer(top=top, bottom=bottom)
+
+
+def _layer_bounds(shape):
+    """(top, bottom) of a full width horizontal layer, None for any other shape."""
+    if type(shape).__name__ not in ("Layer", "Layer2D"):
+        return None
+    if getattr(shape, "minX", None) is not None or getattr(shape, "maxX", None) is not None:
+        return None
+    return GEO.nd(shape.top), GEO.nd(shape.bottom)
+
+
+def layer_stack(shapes):
+    """Bounds of every shape if they form a stack of non overlapping horizontal
+    layers (None entries are materials without a shape), otherwise None."""
+    bounds = [_layer_bounds(shape) for shape in shapes if shape is not None]
+    if None in bounds:
+        return None
+    bounds.sort(key=lambda bound: bound[1])
+    for (top, bottom), (nextTop, nextBottom) in zip(bounds[:-1], bounds[1:]):
+        if top > nextBottom:
+            return None
+    return bounds
+
+
+def assign_layers(Model, materials):
+    """Material index of every particle from a stack of horizontal layers, see
+    rift_layers.layer_indices. Particles outside every layer keep theirs."""
+    layers = [(GEO.nd(m.shape.bottom), GEO.nd(m.shape.top), m.index) for m in materials]
+    index = layer_indices(layers, Model.swarm.particleCoordinates.data[:, 1])
+    inside = index >= 0
+    Model.materialField.data[inside, 0] = index[inside]
+
+
+def _add_material(Model, spec, params, shape, assignShape=True):
+    if shape is None:
+        material = Model.add_material(name=params["name"])
+    elif assignShape:
+        material = Model.add_material(name=params["name"], shape=shape)
+    else:
+        #Layered fast path, the particles are assigned afterwards by assign_layers
+        material = Model.add_material(name=params["name"])
+        material.shape = shape
+
+    if "thermalExpansivity" in params:
+        material.density = GEO.LinearDensity(reference_density=_q(params["density"]),
+                                             thermalExpansivity=_q(params["thermalExpansivity"]))
+    else:
+        material.density = _q(params["density"])
+    for key in ("radiogenicHeatProd", "diffusivity", "capacity", "compressibility",
+                "temperatureLimiter", "stressLimiter"):
+        if params.get(key) is not None:
+            setattr(material, key, _q(params[key]))
+
+    material.viscosity = _viscosity(params["viscosity"])
+    if params.get("plasticity"):
+        material.plasticity = _plasticity(params["plasticity"])
+
+    melt = params.get("melt")
+    if melt:
+        kwargs = {key: _q(value) for key, value in melt.items() if key not in ("solidus", "liquidus")}
+        material.add_melt_modifier(_melt_curve(spec, melt["solidus"]),
+                                   _melt_curve(spec, melt["liquidus"]), **kwargs)
+    return material
+
+
+def set_velocityBCs(Model, spec):
+    #Defining velocity boundary conditions
+    velocity = _q(spec["velocity"])
+    #A free surface has no constraint on the top boundary
+    top = None if spec.get("freeSurface") else [None, 0.0 * u.centimeter / u.year]
+    Model.set_velocityBCs(left=[-velocity, 0.0 * u.centimeter / u.year],
+                          right=[velocity, 0.0 * u.centimeter / u.year],
+                          top=top)
+
+    Model.set_stressBCs(bottom=[0., _q(spec["basalTraction"])])
+
+
+def seed_damage(Model, spec):
+    damage = spec["damage"]
+    centre = (GEO.nd(_q(damage["centre"][0])), GEO.nd(_q(damage["centre"][1])))
+    width = GEO.nd(_q(damage["width"]))  # this gives a normal distribution
+
+    damage_field(Model.swarm.particleCoordinates.data, damage["maxDamage"], centre, width,
+                 width * damage["verticalWidthFactor"], GEO.nd(0 * u.kilometer), damage["seed"],
+                 Model.plasticStrain.data[:, 0])
+
+
+def add_tracers(Model, spec, place=True):
+    """Passive tracer swarms of spec, keyed by name. With place=False the swarms
+    start empty, for a model whose tracers come from the init cache."""
+    tracers = {}
+    for params in spec["tracers"]:
+        if params["type"] == "line":
+            npoints = params["npoints"]
+            coords = np.ndarray((npoints, 2))
+            coords[:, 0] = np.linspace(GEO.nd(Model.minCoord[0]), GEO.nd(Model.maxCoord[0]), npoints)
+            coords[:, 1] = GEO.nd(_q(params["y"]))
+        else:
+            coords = GEO.circles_grid(radius=_q(params["radius"]),
+                                      minCoord=[Model.minCoord[0], _q(params["bottom"])],
+                                      maxCoord=[Model.maxCoord[0], _q(params["top"])])
+        if place:
+            tracers[params["name"]] = Model.add_passive_tracers(name=params["name"], vertices=coords)
+            tag_tracers(tracers[params["name"]], GEO.nd(coords))
+        else:
+            tracers[params["name"]] = Model.add_passive_tracers(name=params["name"], vertices=coords[:0])
+            add_tracer_ids(tracers[params["name"]], len(coords))
+    return tracers
+
+
+def build_model(spec):
+    """Build a new, not yet initialised, model described by spec.
+
+    Every call returns an independent Model. The property objects (viscous laws,
+    plasticity, melt curves) are shared between models through _cached, so a
+    batch of runs only converts their units once.
+    """
+    for name, value in spec["rcParams"].items():
+        GEO.rcParams[name] = value
+    GEO.rcParams["default.outputs"] = checkpoint_fields(spec["rcParams"].get("default.outputs", DEFAULT_OUTPUTS),
+                                                        (spec.get("outputs") or {}).get("dropFields", ()))
+    set_scaling(spec)
+
+    #Defining the model bounds
+    axes = mesh_axes(spec)
+    Model = GEO.Model(elementRes=mesh_resolution(spec, axes),
+                      minCoord=tuple(_q(x) for x in spec["minCoord"]),
+                      maxCoord=tuple(_q(x) for x in spec["maxCoord"]),
+                      gravity=(0.0, -_q(spec["gravity"])))
+    if any(nodes is not None for nodes in axes):
+        grade_mesh(Model, axes)
+        relayout_swarm(Model)
+
+    #Output directory
+    Model.outputDir = spec["outputDir"]
+
+    #With a cached initialised state the materials, the damage and the tracers of
+    #the particles come from the cache (see init_model), so they are not set up here
+    Model.initCacheHit = init_cache_hit(spec)
+
+    Model.diffusivity = _q(spec["diffusivity"])
+    Model.capacity = _q(spec["capacity"])
+    Model.minViscosity = _q(spec["minViscosity"])
+    Model.maxViscosity = _q(spec["maxViscosity"])
+
+    #Pure layer stacks get their material indices in one pass, anything else goes
+    #through the general per shape assignment of add_material
+    shapes = [_shape(Model, params) for params in spec["materials"]]
+    layered = layer_stack(shapes) is not None
+    assignShape = not (layered or Model.initCacheHit)
+    materials = {}
+    for params, shape in zip(spec["materials"], shapes):
+        materials[params["name"]] = _add_material(Model, spec, params, shape, assignShape=assignShape)
+    Model.materials_by_name = materials
+    if uw.mpi.rank == 0:
+        print("{0} materials, {1} distinct rheologies".format(len(materials), len(rheology_groups(spec))))
+    if layered and not Model.initCacheHit:
+        assign_layers(Model, [material for material in materials.values() if material.shape is not None])
+
+    #Defining temperature conditions
+    bcs = spec["temperatureBCs"]
+    Model.set_temperatureBCs(top=_q(bcs["top"]),
+                             bottom=_q(bcs["bottom"]),
+                             nodeSets=[(materials[name].shape, _q(T)) for name, T in bcs["nodeSets"]])
+
+    set_velocityBCs(Model, spec)
+
+    if not Model.initCacheHit:
+        seed_damage(Model, spec)
+
+    surface = spec["surfaceProcesses"]
+    air = [materials[name] for name in surface["air"]]
+    sediment = [materials[name] for name in surface["sediment"]]
+    if spec.get("freeSurface"):
+        Model.freeSurface = True
+        Model.surfaceProcesses = FreeSurfaceSedimentation(Model, sediment, _q(surface["threshold"]), uw.mpi.comm)
+    elif surface.get("band"):
+        Model.surfaceProcesses = BandedSedimentation(Model, air, sediment, _q(surface["threshold"]),
+                                                     _q(surface["band"]), uw.mpi.comm)
+    else:
+        Model.surfaceProcesses = SedimentationThreshold(air=air, sediment=sediment,
+                                                        threshold=_q(surface["threshold"]))
+
+    Model.tracers_by_name = add_tracers(Model, spec, place=not Model.initCacheHit)
+    Model.tracerIds = TracerIds(Model, uw.mpi.comm)
+
+    Model.swarm.allow_parallel_nn = True
+
+    if spec.get("strainTaper"):
+        Model.post_solve_functions["Boundary strain taper"] = BoundaryStrainTaper(Model, **spec["strainTaper"])
+
+    return Model
+
+
+def attach_swarm_variables(Model):
+    """Make the hooks that keep their own variables on Model.swarm add them to the
+    current swarm now, e.g. after Model.restart replaced it, so that a snapshot
+    taken next has the same variables as the swarm will have during the run."""
+    taper = Model.post_solve_functions.get("Boundary strain taper")
+    if taper is not None:
+        taper.attach()
+    surface = getattr(Model, "surfaceProcesses", None)
+    if isinstance(surface, BandedSedimentation):
+        surface.attach()
+
+
+def configure_solver(Model, spec, config=None):
+    """Apply spec["solver"], overlaid with config or else with the tuned profile
+    for this spec and rank count if rift_solver.py has written one."""
+    if config is None:
+        config = load_profile(spec, uw.mpi.size)
+        if config is not None and uw.mpi.rank == 0:
+            print("Using tuned solver profile: {0}".format(config["name"]))
+    options = merge_options(spec["solver"], config or {})
+    solver = Model.solver
+    Model.solverOptions = options
+    resolution = mesh_resolution(spec)
+
+    # Decide whether to use mumps or multigrid
+    inner = options.get("inner")
+    if inner is None:
+        inner = "mumps" if resolution[0] * resolution[1] < options["mumpsThreshold"] else "mg"
+    if inner == "mumps":
+        print("Using mumps")
+        solver.set_inner_method("mumps")
+    else:
+        print("Using multigrid with coarse mumps")
+        solver.set_inner_method("mg")
+        solver.options.A11.mg_coarse_pc_factor_mat_solver_package = "mumps"
+        solver.options.A11.mg_coarse_pc_type = "lu"
+        solver.options.A11.mg_coarse_ksp_type = "preonly"
+
+    for name, value in options["A11"].items():
+        setattr(solver.options.A11, name, value)
+    for name, value in options["scr"].items():
+        setattr(solver.options.scr, name, value)
+    solver.options.main.remove_constant_pressure_null_space = True
+    solver.set_penalty(options["penalty"])
+    if options.get("reuse"):
+        set_reuse_options(solver, inner, options["reuse"])
+    else:
+        solver.options.A11.ksp_reuse_preconditioner = False
+    return solver
+
+
+class BoundaryStrainTaper(object):
+    """Heals plasticStrain towards the lateral walls after every solve.
+
+    Particles are multiplied by (tanh(s z) + tanh(s (1 - z)) - tanh(s))**4, with z
+    the relative x position and s the sharpness. The factor is stored on the
+    particles and only recomputed for particles that changed taper bin since the
+    last call, or that were just created by population control.
+    """
+
+    def __init__(self, Model, sharpness=20.0, bins=4096):
+        self.Model = Model
+        self.sharpness = sharpness
+        self.bins = bins
+        self.minX = GEO.nd(Model.minCoord[0])
+        self.length = GEO.nd(Model.maxCoord[0]) - self.minX
+        self._swarm = None
+        #Attached straight away so that snapshots of the initialised state have the variables
+        self.attach()
+
+    def factor(self, x):
+        zz = (x - self.minX) / self.length
+        s = self.sharpness
+        return (np.tanh(zz * s) + np.tanh((1.0 - zz) * s) - np.tanh(s))**4
+
+    def attach(self):
+        """Add the taper variables to Model.swarm, unless they are already on it."""
+        if self.Model.swarm is self._swarm:
+            return
+        #Bins are stored shifted by one so 0 marks particles that have never been seen
+        self._swarm = self.Model.swarm
+        self._bin = self._swarm.add_variable(dataType="int", count=1)
+        self._factor = self._swarm.add_variable(dataType="double", count=1)
+        self._bin.data[:] = 0
+
+    def __call__(self):
+        self.attach()
+
+        x = self.Model.swarm.particleCoordinates.data[:, 0]
+        bins = np.clip(((x - self.minX) * (self.bins / self.length)).astype(np.int32), 0, self.bins - 1) + 1
+        stored = self._bin.data[:, 0]
+        stale = np.flatnonzero(bins != stored)
+        if len(stale):
+            self._factor.data[stale, 0] = self.factor(x[stale])
+            stored[stale] = bins[stale]
+
+        self.Model.plasticStrain.data[:, 0] *= self._factor.data[:, 0]
+
+
+def model_time(Model):
+    """Current model time in years."""
+    time = Model.time
+    if not hasattr(time, "units") or time.dimensionless:
+        time = GEO.dimensionalise(time, u.year)
+    return time.to(u.year).magnitude
+
+
+#Spec entries that do not change the initialised model state
+INIT_INDEPENDENT_KEYS = ("name", "outputDir", "rcParams", "solver", "duration",
+                         "checkpointInterval", "asyncCheckpoints", "outputs", "diagnostics",
+                         "instrumentation", "initCache", "solverProfile", "meltTables", "warmStart",
+                         "timeStepControl", "nonlinearStrategy", "thermalLag")
+
+
+def init_cache_dir(spec, nprocs=None):
+    """Cache directory for the initialised state of spec on nprocs ranks."""
+    nprocs = uw.mpi.size if nprocs is None else nprocs
+    key = spec_hash(spec, exclude=INIT_INDEPENDENT_KEYS)
+    return os.path.join(spec["initCache"], "{0}-np{1}".format(key, nprocs))
+
+
+def init_cache_hit(spec):
+    """Whether the initialised state of spec on this rank count is in the init cache."""
+    if not spec.get("initCache"):
+        return False
+    return os.path.exists(os.path.join(init_cache_dir(spec), "complete"))
+
+
+def _init_model(Model, spec):
+    if spec.get("layeredGeotherm"):
+        #The 1-D steady state replaces the steady-state solve on the mesh
+        apply_geotherm(Model, spec)
+        Model.init_model(temperature=False)
+    else:
+        Model.init_model()
+
+
+def init_model(Model, spec):
+    """Model.init_model(), reusing a cached initialised state when there is one.
+
+    The state is cached per spec, resolution and rank count; each rank writes and
+    memory-maps back its own part. Whether the cache is used is decided once, by
+    build_model, which already skipped the material assignment, the damage and the
+    tracers of a model restored from it.
+    """
+    if not spec.get("initCache"):
+        _init_model(Model, spec)
+        return
+
+    cacheDir = init_cache_dir(spec)
+    rankDir = os.path.join(cacheDir, "rank{0}".format(uw.mpi.rank))
+    if Model.initCacheHit:
+        #Everything else comes from the cache, skip the thermal and pressure initialisation
+        Model.init_model(temperature=False, pressure=False)
+        restore_state(Model, load_state(rankDir))
+        return
+
+    _init_model(Model, spec)
+    save_state(snapshot_state(Model), rankDir)
+    uw.mpi.barrier()
+    if uw.mpi.rank == 0:
+        open(os.path.join(cacheDir, "complete"), "w").close()
+
+
+def run_model(Model, spec):
+    #Initialise the model
+    init_model(Model, spec)
+    warmStarted = warm_start(Model, spec, uw.mpi.comm)
+    return run_initialised(Model, spec, warmStarted)
+
+
+def run_initialised(Model, spec, warmStarted=False):
+    """Run an initialised Model with the solver, outputs, diagnostics, hooks and
+    checkpoints of spec. Also used by rift_branch.py for every branch."""
+    configure_solver(Model, spec)
+    if spec.get("meltTables"):
+        use_melt_tables(Model, spec)
+    if spec.get("outputs"):
+        Model.post_solve_functions["Scheduled outputs"] = OutputSchedule(Model, spec["outputs"], uw.mpi.comm)
+    if spec.get("diagnostics"):
+        Model.post_solve_functions["Diagnostics"] = DiagnosticsHook(Model, spec, uw.mpi.comm)
+    #Hooks with a close(), closed in reverse order
+    hooks = []
+    if spec.get("nonlinearStrategy"):
+        hooks.append(NonlinearStrategy(Model, spec["nonlinearStrategy"], uw.mpi.comm))
+    if spec.get("timeStepControl"):
+        hooks.append(TimeStepController(Model, spec["timeStepControl"], uw.mpi.comm))
+    if Model.solverOptions.get("reuse"):
+        hooks.append(PreconditionerReuse(Model, Model.solverOptions["reuse"], uw.mpi.comm))
+    if spec.get("thermalLag"):
+        hooks.append(LaggedThermalSolve(Model, spec, uw.mpi.comm))
+    if spec.get("instrumentation"):
+        hooks.append(StepTimer(Model, uw.mpi.comm))
+    result = _run_for(Model, spec, warmStarted)
+    for hook in reversed(hooks):
+        hook.close()
+    return result
+
+
+def latest_checkpoint_time(outputDir):
+    """Model time (yr) of the last HDF5 checkpoint in outputDir, None if there is none."""
+    if not os.path.isdir(outputDir):
+        return None
+    checkpoint = None
+    for checkpoint in iter_checkpoints(outputDir):
+        pass
+    return None if checkpoint is None else checkpoint.time
+
+
+def _run_for(Model, spec, warmStarted=False):
+    #A warm started run is already part way through spec["duration"]
+    duration = _q(spec["duration"])
+    if warmStarted:
+        duration = max(duration.to(u.year).magnitude - model_time(Model), 0.) * u.year
+    run = {"checkpoint_interval": _q(spec["checkpointInterval"]),
+           "restartStep": -1, "restartDir": spec["outputDir"]}
+    #The time step controller adapts the CFL factor, maxDt bounds dt itself
+    if spec.get("timeStepControl"):
+        run["dt"] = _q(spec["timeStepControl"]["maxDt"])
+    if not spec.get("asyncCheckpoints"):
+        return Model.run_for(duration, **run)
+
+    #Restart from the last restart snapshot if it is newer than the last HDF5
+    #checkpoint, otherwise from the checkpoint as usual
+    outputDir = spec["outputDir"]
+    steps = complete_checkpoints(outputDir, uw.mpi.size)
+    if steps:
+        last = latest_checkpoint_time(outputDir)
+        if last is None or checkpoint_time(outputDir, steps[-1]) > last:
+            load_checkpoint(Model, outputDir, steps[-1], uw.mpi.rank)
+            remaining = _q(spec["duration"]).to(u.year).magnitude - model_time(Model)
+            if remaining <= 0:
+                return
+            duration = remaining * u.year
+            run["restartStep"] = None
+
+    writer = AsyncCheckpointWriter(outputDir, uw.mpi.rank, uw.mpi.size)
+    Model.post_solve_functions["Async checkpoint"] = CheckpointHook(
+        Model, writer, _q(spec["asyncCheckpoints"]["every"]).to(u.year).magnitude)
+    try:
+        return Model.run_for(duration, **run)
+    finally:
+        del Model.post_solve_functions["Async checkpoint"]
+        writer.close()
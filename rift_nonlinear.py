@@ -0,0 +1,142 @@
+# Nonlinear solve strategy.
+#
+# UWGeodynamics solves the Stokes problem by Picard iteration to a fixed
+# GEO.rcParams["nonlinear.tolerance"]. NonlinearStrategy does two things:
+#
+#  - tolerance: while the velocity barely changes from one step to the next,
+#    the tolerance of the next solve is loosened step by step up to
+#    maxTolerance, and it is reset to the spec's tolerance as soon as the
+#    solution moves again or a solve runs out of iterations.
+#  - Anderson acceleration: once the Picard change drops below
+#    anderson["start"], every iterate is replaced by the Anderson mixture of
+#    the last anderson["depth"] iterates (velocity and pressure) before the
+#    viscosity is re-evaluated. The mixing runs in Model.callback_functions,
+#    which the solver calls once each iterate is on the nodes, so the next
+#    iteration assembles its viscosity from the mixture. Underworld 2 has no
+#    Newton solver for the Stokes system, so this is the near-convergence switch.
+#
+# Each step appends the iterations taken, the Picard changes, and an estimate of
+# the iterations plain Picard would have needed at the spec's tolerance (from
+# the contraction rate of the first, unaccelerated iterations), to
+# <outputDir>/nonlinear.jsonl.
+#Written by Youseph Ibrahim
+
+import json
+import math
+import os
+
+import numpy as np
+from mpi4py import MPI
+
+from rift_solver import add_nonlinear_callback
+
+
+class NonlinearStrategy(object):
+    """Pre/post-solve hooks and nonlinear iteration callback of Model."""
+
+    def __init__(self, Model, options, comm, path=None):
+        from rift_model import GEO
+        self.Model = Model
+        self.options = options
+        self.comm = comm
+        self.path = path or os.path.join(Model.outputDir, "nonlinear.jsonl")
+        self.baseTolerance = float(GEO.rcParams["nonlinear.tolerance"])
+        self.tolerance = self.baseTolerance
+        self.maxIterations = GEO.rcParams["nonlinear.max.iterations"]
+        add_nonlinear_callback(Model, "Nonlinear strategy", self)
+        Model.pre_solve_functions["Nonlinear strategy"] = self.start_step
+        Model.post_solve_functions["Nonlinear strategy"] = self.end_step
+        self._stepStart = None
+
+    def _state(self):
+        return np.concatenate([self.Model.velocityField.data.ravel(), self.Model.pressureField.data.ravel()])
+
+    def _set_state(self, x):
+        velocity = self.Model.velocityField.data
+        velocity[:] = x[:velocity.size].reshape(velocity.shape)
+        self.Model.pressureField.data[:] = x[velocity.size:].reshape(self.Model.pressureField.data.shape)
+
+    def _dot(self, a, b):
+        return self.comm.allreduce(float(np.dot(a, b)), op=MPI.SUM)
+
+    def start_step(self):
+        from rift_model import GEO
+        GEO.rcParams["nonlinear.tolerance"] = self.tolerance
+        self._stepStart = self._state()
+        self._x = self._stepStart
+        self._changes = []
+        self._firstAccelerated = None
+        self._outputs = []
+        self._residuals = []
+
+    def __call__(self):
+        g = self._state()
+        f = g - self._x
+        change = math.sqrt(self._dot(f, f) / max(self._dot(g, g), 1e-300))
+        self._changes.append(change)
+
+        anderson = self.options.get("anderson")
+        if not anderson or change >= anderson["start"]:
+            self._x = g
+            return
+        if self._firstAccelerated is None:
+            self._firstAccelerated = len(self._changes) - 1
+        #Restart the mixing whenever it stops helping
+        if len(self._changes) > 1 and change > self._changes[-2]:
+            self._outputs, self._residuals = [], []
+        self._outputs.append(g)
+        self._residuals.append(f)
+        self._outputs = self._outputs[-(anderson["depth"] + 1):]
+        self._residuals = self._residuals[-(anderson["depth"] + 1):]
+        if len(self._residuals) > 1:
+            dF = [b - a for a, b in zip(self._residuals[:-1], self._residuals[1:])]
+            dG = [b - a for a, b in zip(self._outputs[:-1], self._outputs[1:])]
+            A = np.array([[self._dot(a, b) for b in dF] for a in dF])
+            rhs = np.array([self._dot(a, f) for a in dF])
+            gamma = np.linalg.lstsq(A, rhs, rcond=None)[0]
+            g = g - sum(c * d for c, d in zip(gamma, dG))
+            self._set_state(g)
+        self._x = g
+
+    def picard_estimate(self):
+        """Iterations plain Picard would need to reach the spec's tolerance,
+        extrapolated at the contraction rate of the last iterations before the
+        acceleration started (or of the last two iterations), or None."""
+        plain = self._changes[:self._firstAccelerated]
+        if len(plain) < 2:
+            return len(self._changes) if self._firstAccelerated is None else None
+        if plain[-1] <= self.baseTolerance:
+            return len(plain)
+        rate = plain[-1] / plain[-2]
+        if not 0. < rate < 1.:
+            return None
+        extra = int(math.ceil(math.log(self.baseTolerance / plain[-1]) / math.log(rate)))
+        return min(len(plain) + extra, self.maxIterations)
+
+    def end_step(self):
+        from rift_model import model_time
+        iterations = len(self._changes)
+        solution = self._state()
+        delta = solution - self._stepStart
+        stepChange = math.sqrt(self._dot(delta, delta) / max(self._dot(solution, solution), 1e-300))
+        estimate = self.picard_estimate()
+        if self.comm.rank == 0:
+            record = {"step": int(self.Model.step), "time": model_time(self.Model), "tolerance": self.tolerance,
+                      "nonlinear iterations": iterations, "estimated Picard iterations": estimate,
+                      "iterations saved": None if estimate is None else estimate - iterations,
+                      "changes": self._changes, "step change": stepChange}
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+        options = self.options
+        if stepChange < options["quietChange"] and iterations < self.maxIterations:
+            self.tolerance = min(self.tolerance * options["loosen"], options["maxTolerance"])
+        else:
+            self.tolerance = self.baseTolerance
+
+    def close(self):
+        from rift_model import GEO
+        self.Model.callback_functions.pop("Nonlinear strategy", None)
+        self.Model.pre_solve_functions.pop("Nonlinear strategy", None)
+        self.Model.post_solve_functions.pop("Nonlinear strategy", None)
+        GEO.rcParams["nonlinear.tolerance"] = self.baseTolerance
@@ -0,0 +1,525 @@
+# Model output that does not hold up the run.
+#
+# The full HDF5 checkpoints are still written by Model.run_for at
+# spec["checkpointInterval"]; they are what rift_post.py reads and what a run
+# on any number of ranks can restart from. In between, restart snapshots are
+# taken into memory after the Stokes solve every spec["asyncCheckpoints"]["every"]
+# and written by a background thread while the run carries on. Each rank writes
+# its own part under <outputDir>/restart/<step>/rank<N>/ (one compressed .npz
+# file per array, see rift_state.save_state) and then drops a rank<N>.done
+# marker, so a snapshot only counts as complete once every rank's marker is
+# there. Snapshots hold each rank's local particles, so only a run on the same
+# number of ranks can restore them; complete_checkpoints() refuses to carry on
+# if it finds snapshots of another rank count.
+#
+# Everything else follows spec["outputs"]["schedule"]: each entry has its own
+# cadence and is written by rank 0 to chunked, compressed HDF5, optionally
+# downcast to float32. The full checkpoints are written by underworld itself,
+# uncompressed and in float64; spec["outputs"]["dropFields"] leaves visual-only
+# fields out of them entirely (see checkpoint_fields).
+#
+# Passive tracers carry a tracerId swarm variable giving them a stable order in
+# the tracer time series. The HDF5 checkpoints do not hold it, so TracerIds saves
+# the tracer coordinates in ID order with every checkpoint and gives the tracers
+# their IDs back after a Model.restart that loaded one. Model.run_for writes its
+# checkpoints through UWGeodynamics' _CheckpointFunction, not Model.checkpoint,
+# so wrap_checkpoints hooks that class.
+#Written by Youseph Ibrahim
+
+import json
+import os
+import queue
+import sys
+import threading
+
+import h5py
+import numpy as np
+from scipy.spatial import cKDTree
+
+from rift_state import snapshot_state, restore_state, save_state, load_state
+
+RESTART_DIR = "restart"
+TRACER_IDS_FILE = "tracer_ids.h5"
+
+
+def checkpoint_dir(outputDir, step):
+    return os.path.join(outputDir, RESTART_DIR, "{0:06d}".format(step))
+
+
+def complete_checkpoints(outputDir, nprocs):
+    """Steps of every fully written restart snapshot in outputDir, oldest first.
+
+    Raises RuntimeError if there are complete snapshots written on a different
+    number of ranks, which can not be restored on nprocs ranks.
+    """
+    root = os.path.join(outputDir, RESTART_DIR)
+    if not os.path.isdir(root):
+        return []
+    steps = []
+    others = set()
+    for name in os.listdir(root):
+        directory = os.path.join(root, name)
+        if not name.isdigit() or not os.path.exists(os.path.join(directory, "rank0.done")):
+            continue
+        with open(os.path.join(directory, "rank0.done")) as f:
+            written = json.load(f)["nprocs"]
+        if not all(os.path.exists(os.path.join(directory, "rank{0}.done".format(rank))) for rank in range(written)):
+            continue
+        if written == nprocs:
+            steps.append(int(name))
+        else:
+            others.add(written)
+    if others:
+        raise RuntimeError("{0} has restart snapshots written on {1} ranks, this run has {2}. Run on the same "
+                           "number of ranks, or delete {0} to restart from the HDF5 checkpoints instead".format(
+                               root, " and ".join(str(n) for n in sorted(others)), nprocs))
+    return sorted(steps)
+
+
+class AsyncCheckpointWriter(object):
+    """Writes snapshots on a background thread.
+
+    At most maxPending snapshots are held in memory, submit() blocks if the
+    writer falls that far behind.
+    """
+
+    def __init__(self, outputDir, rank, nprocs, maxPending=2):
+        self.outputDir = outputDir
+        self.rank = rank
+        self.nprocs = nprocs
+        self.error = None
+        self._queue = queue.Queue(maxsize=maxPending)
+        self._thread = threading.Thread(target=self._run, name="checkpoint writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, step, time, state, checkpointID=None):
+        if self.error is not None:
+            raise RuntimeError("Checkpoint writer failed") from self.error
+        self._queue.put((step, time, state, checkpointID))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as error:
+                self.error = error
+            finally:
+                self._queue.task_done()
+
+    def _write(self, step, time, state, checkpointID):
+        directory = checkpoint_dir(self.outputDir, step)
+        save_state(state, os.path.join(directory, "rank{0}".format(self.rank)), compress=True)
+        #The marker is only written once every array of this rank is on disk
+        with open(os.path.join(directory, "rank{0}.done".format(self.rank)), "w") as f:
+            json.dump({"step": step, "time": time, "nprocs": self.nprocs, "checkpointID": checkpointID}, f)
+
+    def flush(self):
+        self._queue.join()
+        if self.error is not None:
+            raise RuntimeError("Checkpoint writer failed") from self.error
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+
+
+class CheckpointHook(object):
+    """Post-solve hook that hands a snapshot to the writer every interval years.
+
+    The snapshot records Model.checkpointID, so that a run restored from it
+    carries on numbering its HDF5 checkpoints where it left off. Like the
+    HDF5 checkpoints, it calls Model.pre_checkpoint_functions first.
+    """
+
+    def __init__(self, Model, writer, interval):
+        from rift_model import model_time
+        self.Model = Model
+        self.writer = writer
+        self.interval = interval
+        self.next = (model_time(Model) // interval + 1) * interval
+
+    def __call__(self):
+        from rift_model import model_time
+        time = model_time(self.Model)
+        if time < self.next:
+            return
+        for function in list(getattr(self.Model, "pre_checkpoint_functions", {}).values()):
+            function()
+        self.writer.submit(int(self.Model.step), time, snapshot_state(self.Model),
+                           getattr(self.Model, "checkpointID", None))
+        self.next = (time // self.interval + 1) * self.interval
+
+
+def checkpoint_time(outputDir, step):
+    """Model time (yr) of a restart snapshot."""
+    with open(os.path.join(checkpoint_dir(outputDir, step), "rank0.done")) as f:
+        return json.load(f)["time"]
+
+
+def load_checkpoint(Model, outputDir, step, rank):
+    """Restore Model from a restart snapshot written by AsyncCheckpointWriter."""
+    from rift_model import u
+    directory = checkpoint_dir(outputDir, step)
+    with open(os.path.join(directory, "rank{0}.done".format(rank))) as f:
+        info = json.load(f)
+    state = load_state(os.path.join(directory, "rank{0}".format(rank)))
+    state["time"] = info["time"] * u.year
+    state["step"] = info["step"]
+    lost = restore_state(Model, state)
+    if info.get("checkpointID") is not None:
+        Model.checkpointID = info["checkpointID"]
+    return lost
+
+
+def checkpoint_fields(fields, drop):
+    """The fields of GEO.rcParams["default.outputs"] that still go into the full
+    checkpoints once the ones in drop are left out."""
+    unknown = sorted(set(drop) - set(fields))
+    if unknown:
+        raise ValueError("Can not drop {0} from the checkpoints, the checkpoint fields are {1}".format(
+            ", ".join(unknown), ", ".join(fields)))
+    return [name for name in fields if name not in drop]
+
+
+#Scheduled outputs
+def gather_mesh_field(mesh, field, comm):
+    """Global nodal values of field in node order on rank 0, None elsewhere."""
+    nodes = mesh.nodesLocal
+    ids = comm.gather(np.array(mesh.data_nodegId[:nodes, 0]), root=0)
+    data = comm.gather(np.array(field.data[:nodes]), root=0)
+    if comm.rank != 0:
+        return None
+    result = np.empty((mesh.nodesGlobal, field.data.shape[1]), dtype=field.data.dtype)
+    result[np.concatenate(ids)] = np.concatenate(data)
+    return result
+
+
+def _checkpoint_class(Model):
+    """The _CheckpointFunction of the UWGeodynamics module that defines the class of Model."""
+    for klass in type(Model).__mro__:
+        cls = getattr(sys.modules.get(klass.__module__), "_CheckpointFunction", None)
+        if cls is not None:
+            return cls
+    raise AttributeError("Can not find the _CheckpointFunction of {0}, the checkpoint hooks need "
+                         "UWGeodynamics 2.13".format(type(Model).__name__))
+
+
+def hook_checkpoint_class(cls):
+    """Make every checkpoint written by cls, a UWGeodynamics _CheckpointFunction,
+    call the pre_checkpoint_functions of its Model before the fields are written
+    and the post_checkpoint_functions after the tracers are. Both the periodic
+    checkpoints of Model.run_for and Model.checkpoint write the fields first and
+    the tracers after them."""
+    if getattr(cls, "hooked", False):
+        return
+    fields, tracers = cls.checkpoint_fields, cls.checkpoint_tracers
+
+    def checkpoint_fields(self, *args, **kwargs):
+        for function in list(getattr(self.Model, "pre_checkpoint_functions", {}).values()):
+            function()
+        return fields(self, *args, **kwargs)
+
+    def checkpoint_tracers(self, *args, **kwargs):
+        result = tracers(self, *args, **kwargs)
+        for function in list(getattr(self.Model, "post_checkpoint_functions", {}).values()):
+            function()
+        return result
+
+    cls.checkpoint_fields = checkpoint_fields
+    cls.checkpoint_tracers = checkpoint_tracers
+    cls.hooked = True
+
+
+def wrap_checkpoints(Model):
+    """Give Model dicts of functions called around its checkpoints and restarts,
+    like its pre_solve_functions and post_solve_functions:
+    pre_checkpoint_functions before every HDF5 checkpoint (and every restart
+    snapshot, see CheckpointHook), post_checkpoint_functions after every HDF5
+    checkpoint and post_restart_functions, called with the restart directory,
+    after every Model.restart that loaded a checkpoint. Model.restart returns
+    without loading anything if there is nothing to restart from, the swarm is
+    only replaced when it does load one."""
+    if hasattr(Model, "pre_checkpoint_functions"):
+        return
+    hook_checkpoint_class(_checkpoint_class(Model))
+    Model.pre_checkpoint_functions = {}
+    Model.post_checkpoint_functions = {}
+    Model.post_restart_functions = {}
+    restart = Model.restart
+
+    def wrapped_restart(*args, **kwargs):
+        swarm = Model.swarm
+        result = restart(*args, **kwargs)
+        if Model.swarm is swarm:
+            return result
+        restartDir = kwargs.get("restartDir", args[1] if len(args) > 1 else None) or Model.outputDir
+        for function in list(Model.post_restart_functions.values()):
+            function(restartDir)
+        return result
+
+    Model.restart = wrapped_restart
+
+
+def add_tracer_ids(tracers, count):
+    """Add the (unset) tracerId variable of a swarm of count passive tracers,
+    unless it already has one."""
+    if getattr(tracers, "tracerId", None) is None:
+        tracers.tracerId = tracers.add_variable(dataType="int", count=1)
+    tracers.tracerCount = count
+
+
+def tag_tracers(tracers, vertices):
+    """Give every local passive tracer the index of the vertex it started at.
+
+    The IDs are stored in a swarm variable, so they travel with the tracers, and
+    give a stable order whatever rank a tracer is on.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    keys = vertices[:, 0] + 1j * vertices[:, 1]
+    order = np.argsort(keys)
+    coords = tracers.particleCoordinates.data
+    local = coords[:, 0] + 1j * coords[:, 1]
+    position = np.clip(np.searchsorted(keys[order], local), 0, len(order) - 1)
+    missing = np.count_nonzero(keys[order][position] != local)
+    if missing:
+        raise ValueError("{0} tracers are not on any of the vertices they were placed at".format(missing))
+    add_tracer_ids(tracers, len(vertices))
+    tracers.tracerId.data[:, 0] = order[position]
+
+
+def retag_tracers(tracers, comm):
+    """New tracer IDs, in the order of the current tracer coordinates."""
+    coords = comm.gather(np.array(tracers.particleCoordinates.data), root=0)
+    if comm.rank == 0:
+        coords = np.concatenate(coords)
+    tag_tracers(tracers, comm.bcast(coords, root=0))
+
+
+def match_tracer_ids(tracers, coords, tolerance=1e-9):
+    """Give every local tracer the ID of the saved coordinate it sits on.
+
+    coords are the tracer coordinates in ID order, NaN for tracers that had left
+    the model. Raises ValueError unless every tracer is within tolerance
+    (non-dimensional) of a saved coordinate, and no two of them of the same one.
+    """
+    ids = np.flatnonzero(~np.isnan(coords[:, 0]))
+    local = tracers.particleCoordinates.data
+    add_tracer_ids(tracers, len(coords))
+    if not len(local):
+        return
+    distance, nearest = cKDTree(coords[ids]).query(local)
+    far = np.count_nonzero(distance > tolerance)
+    if far:
+        raise ValueError("{0} tracers are not on any of the saved tracer coordinates".format(far))
+    if len(np.unique(nearest)) != len(nearest):
+        raise ValueError("Several tracers sit on the same saved tracer coordinate")
+    tracers.tracerId.data[:, 0] = ids[nearest]
+
+
+def gather_tracers(tracers, comm):
+    """Coordinates of every tracer on rank 0 in tracer ID order (NaN for tracers
+    that have left the model), None elsewhere."""
+    data = comm.gather((np.array(tracers.tracerId.data[:, 0]), np.array(tracers.particleCoordinates.data)), root=0)
+    if comm.rank != 0:
+        return None
+    coords = np.full((tracers.tracerCount, 2), np.nan)
+    for ids, local in data:
+        coords[ids] = local
+    return coords
+
+
+class TracerIds(object):
+    """Keeps the tracer IDs of Model across checkpoints and restarts.
+
+    After every HDF5 checkpoint the coordinates of every tracer swarm are
+    written in ID order to <outputDir>/tracers/tracer_ids.h5, one group per
+    checkpoint. After a Model.restart that loaded a checkpoint each tracer gets
+    the ID of the saved coordinate it was reloaded at. A restart from a checkpoint without saved IDs
+    is only allowed into a new output directory, whose tracer series then
+    start from fresh IDs.
+    """
+
+    def __init__(self, Model, comm):
+        self.Model = Model
+        self.comm = comm
+        wrap_checkpoints(Model)
+        Model.post_checkpoint_functions["Tracer IDs"] = self.save
+        Model.post_restart_functions["Tracer IDs"] = self.restore
+
+    def save(self):
+        from rift_model import model_time
+        Model = self.Model
+        coords = {name: gather_tracers(tracers, self.comm) for name, tracers in Model.tracers_by_name.items()}
+        if self.comm.rank != 0:
+            return
+        directory = os.path.join(Model.outputDir, "tracers")
+        os.makedirs(directory, exist_ok=True)
+        with h5py.File(os.path.join(directory, TRACER_IDS_FILE), "a") as f:
+            group = f.require_group("step-{0:06d}".format(int(Model.step)))
+            group.attrs["time"] = model_time(Model)
+            for name, values in coords.items():
+                if name in group:
+                    del group[name]
+                write_compressed(group, name, values)
+
+    def _load(self, restartDir, time):
+        """Saved coordinates of every tracer swarm at time, None if there are none."""
+        path = os.path.join(restartDir, "tracers", TRACER_IDS_FILE)
+        if not os.path.exists(path):
+            return None
+        with h5py.File(path, "r") as f:
+            for group in f.values():
+                if abs(group.attrs["time"] - time) <= 1e-6 * max(abs(time), 1.):
+                    return {name: group[name][...] for name in group}
+        return None
+
+    def restore(self, restartDir):
+        from rift_model import model_time
+        Model = self.Model
+        #The restart may have replaced the tracer swarms
+        passive = getattr(Model, "passive_tracers", None) or {}
+        for name in Model.tracers_by_name:
+            if passive.get(name) is not None:
+                Model.tracers_by_name[name] = passive[name]
+
+        saved = self._load(restartDir, model_time(Model)) if self.comm.rank == 0 else None
+        saved = self.comm.bcast(saved, root=0)
+        if saved is None:
+            if os.path.abspath(restartDir) == os.path.abspath(Model.outputDir):
+                raise RuntimeError("No tracer IDs saved with the checkpoint at {0} yr in {1}, the tracer time "
+                                   "series can not be continued".format(model_time(Model), restartDir))
+            for tracers in Model.tracers_by_name.values():
+                retag_tracers(tracers, self.comm)
+            return
+        for name, tracers in Model.tracers_by_name.items():
+            match_tracer_ids(tracers, saved[name])
+
+
+class TracerSeries(object):
+    """All positions of one tracer swarm in <directory>/<name>.h5.
+
+    The "coordinates" dataset is (tracer, time, xy), extended along time on every
+    append. Each chunk holds timeChunk times of a single tracer, so one tracer's
+    trajectory is read from its own chunks only. start is the model time the run
+    started (or restarted) from, rows a previous run wrote past it are dropped
+    when the series is first appended to. Only used on rank 0.
+    """
+
+    def __init__(self, directory, name, ntracers, start, timeChunk=128):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, name + ".h5")
+        self.ntracers = ntracers
+        self.start = start
+        self.timeChunk = timeChunk
+        self._opened = False
+
+    def _open(self, f):
+        if "coordinates" not in f:
+            f.create_dataset("coordinates", shape=(self.ntracers, 0, 2), maxshape=(self.ntracers, None, 2),
+                             dtype=np.float64, chunks=(1, self.timeChunk, 2),
+                             compression="gzip", shuffle=True)
+            f.create_dataset("time", shape=(0,), maxshape=(None,), dtype=np.float64, chunks=(self.timeChunk,))
+            f.create_dataset("step", shape=(0,), maxshape=(None,), dtype=np.int64, chunks=(self.timeChunk,))
+        else:
+            #After a restart, drop whatever was written past the restart time. The
+            #row at the restart time itself is the state restarted from, it stays
+            keep = int(np.searchsorted(f["time"][...], self.start, side="right"))
+            for name in ("coordinates", "time", "step"):
+                f[name].resize(keep, axis=1 if name == "coordinates" else 0)
+        self._opened = True
+
+    def append(self, time, step, coords):
+        with h5py.File(self.path, "a") as f:
+            if not self._opened:
+                self._open(f)
+            n = f["time"].shape[0]
+            for name in ("coordinates", "time", "step"):
+                f[name].resize(n + 1, axis=1 if name == "coordinates" else 0)
+            f["coordinates"][:, n] = coords
+            f["time"][n] = time
+            f["step"][n] = step
+
+
+def write_compressed(group, name, data, float32=False, compression="gzip", compressionLevel=4):
+    if float32 and data.dtype == np.float64:
+        data = data.astype(np.float32)
+    return group.create_dataset(name, data=data, chunks=True, shuffle=True,
+                                compression=compression, compression_opts=compressionLevel)
+
+
+class OutputSchedule(object):
+    """Post-solve hook writing every entry of spec["outputs"]["schedule"] at its own cadence.
+
+    An entry looks like
+        {"name": "tracers", "every": (5000., "year"), "tracers": ["Surface", "Moho"]}
+    and may list "tracers" (passive tracer swarms, appended to
+    <outputDir>/tracers/<name>.h5) and "fields" (Model mesh variables, one file
+    per output), with "float32": True to downcast the fields.
+
+    The cadence counts from the model time of the first pre-solve, after
+    Model.run_for has restarted the model.
+    """
+
+    def __init__(self, Model, outputs, comm):
+        from rift_model import _q
+        self.Model = Model
+        self.comm = comm
+        self.compression = outputs.get("compression", "gzip")
+        self.compressionLevel = outputs.get("compressionLevel", 4)
+        self.start = None
+        self.entries = []
+        self.series = {}
+        for entry in outputs["schedule"]:
+            self.entries.append([entry, _q(entry["every"]).to("year").magnitude, None])
+        Model.pre_solve_functions["Scheduled outputs"] = self.start_run
+
+    def start_run(self):
+        """Count the cadence from where the run started, once it has restarted."""
+        from rift_model import model_time
+        if self.start is not None:
+            return
+        self.start = model_time(self.Model)
+        for item in self.entries:
+            item[2] = (self.start // item[1] + 1) * item[1]
+
+    def __call__(self):
+        from rift_model import model_time
+        time = model_time(self.Model)
+        for item in self.entries:
+            entry, every, due = item
+            if time >= due:
+                self.write(entry, time)
+                item[2] = (time // every + 1) * every
+
+    def write(self, entry, time):
+        Model = self.Model
+        tracers = {name: gather_tracers(Model.tracers_by_name[name], self.comm) for name in entry.get("tracers", ())}
+        fields = {name: gather_mesh_field(Model.mesh, getattr(Model, name), self.comm)
+                  for name in entry.get("fields", ())}
+        if self.comm.rank != 0:
+            return
+
+        #Tracers are appended to one time series per swarm
+        for name, coords in tracers.items():
+            if name not in self.series:
+                self.series[name] = TracerSeries(os.path.join(Model.outputDir, "tracers"), name, len(coords),
+                                                 self.start)
+            self.series[name].append(time, int(Model.step), coords)
+        if not fields:
+            return
+
+        directory = os.path.join(Model.outputDir, entry["name"])
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "{0}-{1:06d}.h5".format(entry["name"], int(Model.step)))
+        float32 = entry.get("float32", False)
+        with h5py.File(path + ".tmp", "w") as f:
+            f.attrs["time"] = time
+            f.attrs["step"] = int(Model.step)
+            for name, values in fields.items():
+                write_compressed(f.require_group("fields"), name, values, float32,
+                                 self.compression, self.compressionLevel)
+        os.replace(path + ".tmp", path)
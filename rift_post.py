@@ -0,0 +1,202 @@
+# Streaming post-processing of a checkpoint directory.
+#
+#   python rift_post.py Inversion_Narrow_Rift --metrics topography moho strain_width --workers 8
+#
+# Checkpoints are walked in step order by a generator and every metric only
+# opens the datasets it needs, memory-mapped where the HDF5 layout allows it, so
+# nothing but the current checkpoint's inputs is ever held in memory. Checkpoints
+# are reduced in parallel over a process pool, at most two per worker in flight,
+# and the results are written as one JSON line per checkpoint, in time order.
+#Written by Youseph Ibrahim
+
+import argparse
+import json
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+
+CHECKPOINT_FILE = re.compile(r"^(?P<name>.+)-(?P<step>\d+)\.h5$")
+
+#Model length in km and time scale in years (model length / 18 mm/yr half rate),
+#used for data saved without units (non-dimensional)
+MODEL_LENGTH = 720.
+MODEL_TIME = MODEL_LENGTH * 1e6 / 18.
+
+#Years per unit of the time units Underworld writes
+YEARS = {"year": 1., "kiloyear": 1e3, "megayear": 1e6, "day": 1. / 365.25, "second": 1. / 31557600.}
+
+
+def map_dataset(path, name="data"):
+    """Dataset name of path as an array and its attributes, memory-mapped if it is
+    stored contiguously and uncompressed, read otherwise."""
+    with h5py.File(path, "r") as f:
+        ds = f[name]
+        attrs = dict(ds.attrs)
+        attrs.update({key: value for key, value in f.attrs.items() if key not in attrs})
+        offset = ds.id.get_offset() if ds.chunks is None else None
+        if offset is None:
+            return ds[...], attrs
+        return np.memmap(path, dtype=ds.dtype, mode="r", offset=offset, shape=ds.shape), attrs
+
+
+def to_km(values, attrs):
+    units = str(attrs.get("units", ""))
+    if "kilomet" in units:
+        return values
+    if "met" in units:
+        return values / 1e3
+    return values * MODEL_LENGTH
+
+
+def to_years(value):
+    """A time attribute in years. Underworld writes it as a string with units,
+    e.g. "100000.0 year"; a plain number is non-dimensional."""
+    value = np.asarray(value).ravel()[0]
+    if isinstance(value, bytes):
+        value = value.decode()
+    if not isinstance(value, str):
+        return float(value) * MODEL_TIME
+    magnitude, _, units = value.strip().partition(" ")
+    units = units.strip()
+    if not units:
+        return float(magnitude) * MODEL_TIME
+    name = units[:-1] if units.endswith("s") else units
+    if name not in YEARS:
+        raise ValueError("Unknown time units {0!r}".format(units))
+    return float(magnitude) * YEARS[name]
+
+
+class Checkpoint(object):
+    """The files of one checkpoint step, opened lazily."""
+
+    def __init__(self, outputDir, step, files):
+        self.outputDir = outputDir
+        self.step = step
+        self.files = files
+
+    def __contains__(self, name):
+        return name in self.files
+
+    def array(self, name):
+        return map_dataset(self.files[name])
+
+    @property
+    def time(self):
+        for path in self.files.values():
+            with h5py.File(path, "r") as f:
+                for attrs in (f.attrs, f["data"].attrs if "data" in f else {}):
+                    if "time" in attrs:
+                        return to_years(attrs["time"])
+        return None
+
+
+def iter_checkpoints(outputDir, first=None, last=None):
+    """Checkpoints of outputDir in step order."""
+    steps = {}
+    for name in os.listdir(outputDir):
+        match = CHECKPOINT_FILE.match(name)
+        if match:
+            steps.setdefault(int(match.group("step")), {})[match.group("name")] = os.path.join(outputDir, name)
+    for step in sorted(steps):
+        if (first is None or step >= first) and (last is None or step <= last):
+            yield Checkpoint(outputDir, step, steps[step])
+
+
+def read_trajectory(path, tracer):
+    """Time (yr) and coordinates of one tracer from a tracer time series written
+    by rift_output.TracerSeries, e.g. <outputDir>/tracers/Surface.h5."""
+    with h5py.File(path, "r") as f:
+        return f["time"][...], f["coordinates"][tracer]
+
+
+#Metrics, each takes a Checkpoint and returns a dict of numbers
+def _line_tracer(checkpoint, name):
+    coords, attrs = checkpoint.array(name)
+    return to_km(coords[:, 0], attrs), to_km(coords[:, 1], attrs)
+
+
+def topography(checkpoint):
+    x, y = _line_tracer(checkpoint, "Surface")
+    return {"max elevation (km)": float(y.max()), "min elevation (km)": float(y.min()),
+            "relief (km)": float(y.max() - y.min()), "elevation at max (x km)": float(x[np.argmax(y)])}
+
+
+def moho(checkpoint):
+    x, y = _line_tracer(checkpoint, "Moho")
+    return {"mean Moho depth (km)": float(-y.mean()), "max Moho depth (km)": float(-y.min()),
+            "min Moho depth (km)": float(-y.max()), "deepest Moho (x km)": float(x[np.argmin(y)])}
+
+
+def strain_width(checkpoint, threshold=0.5, chunk=1 << 20):
+    """Width holding the central 90% of the particles with plasticStrain above threshold."""
+    strain, _ = checkpoint.array("plasticStrain")
+    coords, attrs = checkpoint.array("swarm")
+    x = []
+    for start in range(0, len(strain), chunk):
+        mask = strain[start:start + chunk, 0] > threshold
+        x.append(np.asarray(coords[start:start + chunk, 0][mask]))
+    x = to_km(np.concatenate(x), attrs)
+    if not len(x):
+        return {"strain width (km)": 0.0, "strain centre (x km)": None}
+    low, centre, high = np.percentile(x, [5, 50, 95])
+    return {"strain width (km)": float(high - low), "strain centre (x km)": float(centre)}
+
+
+METRICS = {
+    "topography": (("Surface",), topography),
+    "moho": (("Moho",), moho),
+    "strain_width": (("swarm", "plasticStrain"), strain_width),
+}
+
+
+def reduce_checkpoint(checkpoint, metrics):
+    result = {"step": checkpoint.step, "time": checkpoint.time}
+    for name in metrics:
+        inputs, metric = METRICS[name]
+        if all(dataset in checkpoint for dataset in inputs):
+            result.update(metric(checkpoint))
+    return result
+
+
+def reduce_run(outputDir, metrics, workers=1, first=None, last=None):
+    """Metrics of every checkpoint of outputDir, yielded in step order."""
+    checkpoints = iter_checkpoints(outputDir, first, last)
+    if workers <= 1:
+        for checkpoint in checkpoints:
+            yield reduce_checkpoint(checkpoint, metrics)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        #Only file names go to the workers, each one maps its own datasets. The
+        #walk only runs 2 * workers checkpoints ahead of the oldest pending
+        #result, which is handed back first, so results come in step order.
+        pending = deque()
+        for checkpoint in checkpoints:
+            pending.append(pool.submit(reduce_checkpoint, checkpoint, metrics))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reduce the checkpoints of a run to time series of rift metrics")
+    parser.add_argument("outputDir", help="checkpoint directory of the run")
+    parser.add_argument("--metrics", nargs="+", default=sorted(METRICS), choices=sorted(METRICS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--first", type=int, help="first step to reduce")
+    parser.add_argument("--last", type=int, help="last step to reduce")
+    parser.add_argument("--output", help="JSONL file to write, defaults to <outputDir>/metrics.jsonl")
+    args = parser.parse_args(argv)
+
+    path = args.output or os.path.join(args.outputDir, "metrics.jsonl")
+    with open(path, "w") as f:
+        for result in reduce_run(args.outputDir, args.metrics, args.workers, args.first, args.last):
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# Stokes solver configurations and the tuning harness that picks between them.
+#
+#   mpirun -np 192 python rift_solver.py Narrow_Rift --steps 3
+#
+# Tuning runs a few real nonlinear steps of the model from its initialised state
+# under every candidate configuration. It times each one, counts its nonlinear
+# iterations, and writes the fastest configuration that converged to a profile
+# file. configure_solver() picks that profile up automatically in later runs.
+#Written by Youseph Ibrahim
+
+import argparse
+import json
+import os
+import time
+
+#Refresh the reused A11 preconditioner once its A11 solves take twice as many
+#KSP iterations as in the first step that reused it, or after 50 steps
+REUSE = {"refreshFactor": 2.0, "maxAge": 50, "ksp_type": "fgmres"}
+
+#Candidate configurations, applied on top of spec["solver"].
+#"inner" is "mumps" or "mg" (multigrid with a coarse mumps LU).
+SOLVER_CONFIGS = [
+    {"name": "mumps, penalty 1e5", "inner": "mumps", "penalty": 1e5},
+    {"name": "mumps, penalty 1e3", "inner": "mumps", "penalty": 1e3},
+    {"name": "mumps, no penalty", "inner": "mumps", "penalty": 0.},
+    {"name": "mumps, penalty 1e5, scr fgmres", "inner": "mumps", "penalty": 1e5, "scr": {"ksp_type": "fgmres"}},
+    {"name": "mg, penalty 1e5", "inner": "mg", "penalty": 1e5},
+    {"name": "mg, penalty 1e3", "inner": "mg", "penalty": 1e3},
+    {"name": "mumps, penalty 1e5, reuse", "inner": "mumps", "penalty": 1e5, "reuse": REUSE},
+]
+
+
+def merge_options(options, config):
+    """spec["solver"] with a configuration layered on top, the A11/scr blocks are merged."""
+    merged = dict(options)
+    for key, value in config.items():
+        if key in ("A11", "scr"):
+            merged[key] = dict(options.get(key, {}), **value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def add_nonlinear_callback(Model, name, function):
+    """Call function after every nonlinear iteration of the Stokes solve of Model.
+
+    Model.solve() hands the bound Model._callback_post_solve to the solver, which
+    calls it once the solution of each nonlinear iteration is on the nodes; in
+    UWGeodynamics 2.13 it calls every entry of Model.callback_functions in turn.
+    """
+    if getattr(Model, "callback_functions", None) is None:
+        raise AttributeError("Model has no callback_functions, the nonlinear iteration hooks need UWGeodynamics 2.13")
+    Model.callback_functions[name] = function
+
+
+class IterationCounter(object):
+    """Counts the nonlinear iterations of Model, registered as name in
+    Model.callback_functions."""
+
+    def __init__(self, Model, name="Iteration counter"):
+        self.Model = Model
+        self.name = name
+        self.count = 0
+        add_nonlinear_callback(Model, name, self)
+
+    def __call__(self):
+        self.count += 1
+
+    def take(self):
+        """Iterations since the last call."""
+        count, self.count = self.count, 0
+        return count
+
+    def remove(self):
+        self.Model.callback_functions.pop(self.name, None)
+
+
+def set_reuse_options(solver, inner, reuse):
+    """PETSc options keeping the A11 preconditioner between its solves.
+
+    The mesh topology never changes, so the ordering and the MUMPS symbolic
+    analysis are kept. The numeric factorisation (or the multigrid
+    preconditioner) is kept too, which needs a Krylov method instead of a
+    single preconditioner application, as it goes stale between refreshes.
+
+    The BSSCR solver of underworld 2.13 builds the A11 KSP with the Schur
+    complement of every linear solve and destroys it at the end, so there the
+    preconditioner is only kept within a linear solve, over its pre-solve,
+    Schur complement iterations and back-solve.
+    """
+    A11 = solver.options.A11
+    A11.ksp_reuse_preconditioner = True
+    A11.ksp_type = reuse.get("ksp_type", "fgmres")
+    if inner == "mumps":
+        A11.pc_factor_reuse_ordering = True
+    else:
+        A11.mg_coarse_pc_factor_reuse_ordering = True
+
+
+#A11 KSP iterations in the statistics of the Stokes solver
+A11_ITERATIONS = ("velocity_presolve_its", "velocity_pressuresolve_its", "velocity_backsolve_its")
+
+
+def a11_iterations(solver):
+    """A11 KSP iterations and A11 solves of the last linear solve of solver: one
+    solve per Schur complement iteration, plus the pre- and back-solve."""
+    if not callable(getattr(solver, "get_stats", None)):
+        raise AttributeError("The Stokes solver has no get_stats, preconditioner reuse needs the A11 iteration counts")
+    stats = solver.get_stats()
+    stat = (lambda name: stats[name]) if isinstance(stats, dict) else (lambda name: getattr(stats, name))
+    iterations = sum(int(stat(name)) for name in A11_ITERATIONS)
+    return iterations, int(stat("pressure_its")) + 2
+
+
+class PreconditionerReuse(object):
+    """Decides when the reused A11 preconditioner is refreshed.
+
+    Underworld passes the A11 options to PETSc when a Stokes solve starts, so
+    the decision is taken in a pre-solve hook, once per step. The solver
+    statistics only cover the last linear solve, so they are summed over the
+    nonlinear iterations of the step from Model.callback_functions. A step that
+    refreshes builds a fresh preconditioner, the steps after it reuse it. The
+    first of them sets the reference A11 iterations per A11 solve. Once a step
+    needs refreshFactor times that, or maxAge steps have used the
+    preconditioner, the next step refreshes it.
+    """
+
+    def __init__(self, Model, reuse, comm):
+        self.Model = Model
+        self.comm = comm
+        self.refreshFactor = reuse["refreshFactor"]
+        self.maxAge = reuse.get("maxAge")
+        self.age = 0
+        self.reference = None
+        self.steps = 0
+        self.refreshes = 0
+        self.iterations = 0
+        self.solves = 0
+        Model.pre_solve_functions["Preconditioner reuse"] = self
+        add_nonlinear_callback(Model, "Preconditioner reuse", self.count)
+
+    def _reuse(self, flag):
+        self.Model.solver.options.A11.ksp_reuse_preconditioner = flag
+
+    def count(self):
+        """Add the A11 iterations of the linear solve that just finished."""
+        iterations, solves = a11_iterations(self.Model.solver)
+        self.iterations += iterations
+        self.solves += solves
+
+    def __call__(self):
+        refresh = self.steps == 0
+        if self.steps and self.solves:
+            #The statistics are the same on every rank
+            iterations = float(self.iterations) / self.solves
+            self.age += 1
+            if self.age == 2:
+                self.reference = iterations
+            elif self.age > 2 and (iterations > self.refreshFactor * self.reference or
+                                   (self.maxAge and self.age > self.maxAge)):
+                refresh = True
+                self.refreshes += 1
+        if refresh:
+            self.age = 0
+            self.reference = None
+        self.iterations = self.solves = 0
+        self._reuse(not refresh)
+        self.steps += 1
+
+    def close(self):
+        self.Model.pre_solve_functions.pop("Preconditioner reuse", None)
+        self.Model.callback_functions.pop("Preconditioner reuse", None)
+        self._reuse(False)
+        if self.comm.rank == 0:
+            print("A11 preconditioner refreshed {0} times in {1} steps".format(self.refreshes, self.steps))
+
+
+#Profiles, one JSON file per model spec and rank count
+def profile_path(spec, nprocs):
+    from rift_model import spec_hash, INIT_INDEPENDENT_KEYS
+    key = spec_hash(spec, exclude=INIT_INDEPENDENT_KEYS)
+    return os.path.join(spec["solverProfile"], "{0}-np{1}.json".format(key, nprocs))
+
+
+def load_profile(spec, nprocs):
+    """The tuned configuration for spec on nprocs ranks, or None."""
+    if not spec.get("solverProfile"):
+        return None
+    try:
+        with open(profile_path(spec, nprocs)) as f:
+            return json.load(f)["config"]
+    except FileNotFoundError:
+        return None
+
+
+def write_profile(spec, nprocs, config, results):
+    path = profile_path(spec, nprocs)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"model": spec["name"], "nprocs": nprocs, "config": config, "results": results}, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def tune_solver(Model, spec, configs=SOLVER_CONFIGS, nsteps=3):
+    """Time nsteps of Model under every configuration, returns one result per configuration.
+
+    Model must be initialised, it is put back into its initialised state before
+    every configuration.
+    """
+    import underworld as uw
+    from mpi4py import MPI
+    from rift_model import configure_solver
+    from rift_state import snapshot_state, restore_state
+
+    maxIterations = spec["rcParams"]["nonlinear.max.iterations"]
+    state = snapshot_state(Model)
+    counter = IterationCounter(Model, "Solver tuning")
+    results = []
+    try:
+        for config in configs:
+            restore_state(Model, state)
+            configure_solver(Model, spec, config)
+            #Tune reuse the way the run uses it, with its refreshes
+            reuse = PreconditionerReuse(Model, config["reuse"], uw.mpi.comm) if config.get("reuse") else None
+            counter.take()
+            iterations = []
+            start = time.time()
+            try:
+                for step in range(nsteps):
+                    Model.run_for(nstep=1)
+                    iterations.append(counter.take())
+                converged = max(iterations) < maxIterations
+            except Exception as error:
+                converged = False
+                if uw.mpi.rank == 0:
+                    print("Solver configuration {0} failed: {1}".format(config["name"], error))
+            finally:
+                if reuse is not None:
+                    reuse.close()
+            wall = uw.mpi.comm.allreduce(time.time() - start, op=MPI.MAX)
+            results.append({"config": config, "wall": wall, "iterations": iterations, "converged": converged})
+            if uw.mpi.rank == 0:
+                print("{0:<36} {1:>8.1f} s  iterations {2}{3}".format(
+                    config["name"], wall, iterations, "" if converged else "  (not converged)"))
+    finally:
+        counter.remove()
+        restore_state(Model, state)
+    return results
+
+
+def best_config(results):
+    converged = [result for result in results if result["converged"]]
+    if not converged:
+        return None
+    return min(converged, key=lambda result: result["wall"])["config"]
+
+
+def main(argv=None):
+    from rift_model import SPECS, build_model, init_model
+    import underworld as uw
+
+    parser = argparse.ArgumentParser(description="Pick the fastest converging Stokes solver configuration")
+    parser.add_argument("model", choices=sorted(SPECS), help="model to tune")
+    parser.add_argument("--steps", type=int, default=3, help="nonlinear steps per configuration")
+    args = parser.parse_args(argv)
+
+    spec = dict(SPECS[args.model])
+    spec["outputDir"] = os.path.join(spec["outputDir"], "solver_tuning")
+    Model = build_model(spec)
+    init_model(Model, spec)
+    results = tune_solver(Model, spec, nsteps=args.steps)
+
+    config = best_config(results)
+    if config is None:
+        raise RuntimeError("No solver configuration converged")
+    if uw.mpi.rank == 0:
+        write_profile(spec, uw.mpi.size, config, results)
+        print("Using {0} from now on ({1})".format(config["name"], profile_path(spec, uw.mpi.size)))
+
+
+if __name__ == "__main__":
+    main()
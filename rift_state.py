@@ -0,0 +1,125 @@
+# In-memory snapshots of the evolving state of a rift model: the material swarm and
+# its variables (materialField, plasticStrain, ...), the mesh fields, the passive
+# tracers and the model clock. Snapshots only hold each rank's local data, so a
+# restore has to happen on the same decomposition the snapshot was taken on.
+#Written by Youseph Ibrahim
+
+import json
+import os
+
+import numpy as np
+
+MESH_FIELDS = ("temperature", "pressureField", "velocityField")
+
+#Particles moved here are outside the domain and get dropped on the next owner update
+OUTSIDE = 1.0e30
+
+
+def _swarm_variables(swarm):
+    return [var for var in swarm.variables
+            if var is not swarm.particleCoordinates and var is not getattr(swarm, "owningCell", None)]
+
+
+def _snapshot_swarm(swarm):
+    return {"coordinates": np.array(swarm.particleCoordinates.data),
+            "variables": [np.array(var.data) for var in _swarm_variables(swarm)]}
+
+
+def _restore_swarm(swarm, state):
+    variables = _swarm_variables(swarm)
+    if len(variables) != len(state["variables"]):
+        raise ValueError("The swarm has {0} variables but the snapshot has {1}, it was taken from a "
+                         "differently set up model".format(len(variables), len(state["variables"])))
+    coordinates = state["coordinates"]
+    if swarm.particleLocalCount == len(coordinates) and np.array_equal(swarm.particleCoordinates.data, coordinates):
+        #Same particles as the snapshot (e.g. straight after build_model), only the variables need copying
+        for var, data in zip(variables, state["variables"]):
+            var.data[:] = data
+        return 0
+
+    with swarm.deform_swarm():
+        swarm.data[:] = OUTSIDE
+    swarm.update_particle_owners()
+
+    local = swarm.add_particles_with_coordinates(np.ascontiguousarray(coordinates))
+    added = local >= 0
+    for var, data in zip(variables, state["variables"]):
+        var.data[local[added]] = data[added]
+    return np.count_nonzero(~added)
+
+
+def snapshot_state(Model):
+    """Copy the local part of everything a run evolves into memory."""
+    return {"swarm": _snapshot_swarm(Model.swarm),
+            "fields": {name: np.array(getattr(Model, name).data) for name in MESH_FIELDS},
+            "tracers": {name: _snapshot_swarm(tracers) for name, tracers in Model.tracers_by_name.items()},
+            "time": Model.time,
+            "step": Model.step}
+
+
+def restore_state(Model, state):
+    """Put Model back into the state captured by snapshot_state().
+
+    Returns the number of particles that could not be placed back on this rank,
+    which is only non zero if the decomposition changed in between. Raises
+    ValueError if a swarm does not have as many variables as its snapshot (for a
+    snapshot read by load_state, as many as its index.json lists).
+    """
+    lost = _restore_swarm(Model.swarm, state["swarm"])
+    for name, data in state["fields"].items():
+        getattr(Model, name).data[:] = data
+    for name, tracerState in state["tracers"].items():
+        _restore_swarm(Model.tracers_by_name[name], tracerState)
+    if "time" in state:
+        Model.time = state["time"]
+        Model.step = state["step"]
+    return lost
+
+
+#Snapshots on disk, one .npy file per array so they can be memory-mapped back in
+def _swarm_files(prefix, swarmState):
+    yield prefix + "-coordinates", swarmState["coordinates"]
+    for index, data in enumerate(swarmState["variables"]):
+        yield "{0}-variable{1}".format(prefix, index), data
+
+
+def save_state(state, directory, compress=False):
+    """Write the arrays of a snapshot (not the clock) to directory, as .npy files
+    or, with compress=True, as compressed .npz files that can not be memory-mapped."""
+    os.makedirs(directory, exist_ok=True)
+    index = {"compressed": compress,
+             "variables": len(state["swarm"]["variables"]),
+             "fields": sorted(state["fields"]),
+             "tracers": {name: len(tracerState["variables"]) for name, tracerState in state["tracers"].items()}}
+    files = list(_swarm_files("swarm", state["swarm"]))
+    files += [("field-" + name, data) for name, data in state["fields"].items()]
+    for name, tracerState in state["tracers"].items():
+        files += list(_swarm_files("tracer-" + name, tracerState))
+    for name, data in files:
+        if compress:
+            np.savez_compressed(os.path.join(directory, name + ".npz"), data=data)
+        else:
+            np.save(os.path.join(directory, name + ".npy"), data)
+    with open(os.path.join(directory, "index.json"), "w") as f:
+        json.dump(index, f)
+
+
+def load_state(directory, mmap_mode="r"):
+    """Read a snapshot written by save_state(), memory-mapped by default unless
+    it was written compressed."""
+    with open(os.path.join(directory, "index.json")) as f:
+        index = json.load(f)
+
+    def load(name):
+        if index.get("compressed"):
+            with np.load(os.path.join(directory, name + ".npz")) as f:
+                return f["data"]
+        return np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+
+    def load_swarm(prefix, nvariables):
+        return {"coordinates": load(prefix + "-coordinates"),
+                "variables": [load("{0}-variable{1}".format(prefix, i)) for i in range(nvariables)]}
+
+    return {"swarm": load_swarm("swarm", index["variables"]),
+            "fields": {name: load("field-" + name) for name in index["fields"]},
+            "tracers": {name: load_swarm("tracer-" + name, n) for name, n in index["tracers"].items()}}
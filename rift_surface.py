@@ -0,0 +1,135 @@
+# Surface processes restricted to a band around sea level.
+#
+# SedimentationThreshold turns air below the threshold into sediment by
+# evaluating a function over the whole swarm every step, although only air
+# particles close to the threshold can ever cross it. BandedSedimentation keeps
+# a flag (a swarm variable, so it travels with the particles between ranks and
+# through population control) on the air particles less than bandWidth above the
+# threshold and only tests those. The flags are rebuilt from the whole swarm once
+# the particles may have moved bandWidth since the last rebuild, bounded by the
+# largest nodal velocity times dt summed over the steps in between. When
+# Model.swarm is replaced (Model.restart), attach() adds the flag to the new
+# swarm and the next solve rebuilds it.
+#Written by Youseph Ibrahim
+
+import numpy as np
+from mpi4py import MPI
+from underworld.UWGeodynamics.surfaceProcesses import SedimentationThreshold
+
+from rift_mesh import particles_per_side
+
+
+class BandedSedimentation(SedimentationThreshold):
+    """SedimentationThreshold that only looks at the particles in a band above the threshold."""
+
+    def __init__(self, Model, air, sediment, threshold, bandWidth, comm):
+        super(BandedSedimentation, self).__init__(air=air, sediment=sediment, threshold=threshold)
+        self.bandWidth = bandWidth
+        self.comm = comm
+        self.rebuilds = 0
+        self._swarm = None
+        self.attach(Model)
+
+    def attach(self, Model=None):
+        """Add the band flag to Model.swarm, unless it is already on it."""
+        Model = Model or self.Model
+        if Model.swarm is self._swarm:
+            return
+        self._swarm = Model.swarm
+        self.inBand = self._swarm.add_variable(dataType="int", count=1)
+        #Flags on a new swarm are not set, the next solve rebuilds them
+        self.displacement = np.inf
+
+    def _max_speed(self, Model):
+        velocity = Model.velocityField.data
+        local = float(np.sqrt(np.max(np.sum(velocity * velocity, axis=1), initial=0.)))
+        return self.comm.allreduce(local, op=MPI.MAX)
+
+    def _rebuild(self, Model, threshold):
+        from rift_model import GEO
+        air = np.isin(Model.materialField.data[:, 0], [material.index for material in self.air])
+        y = self._swarm.particleCoordinates.data[:, 1]
+        self.inBand.data[:, 0] = air & (y < threshold + GEO.nd(self.bandWidth))
+        self.rebuilds += 1
+
+    def solve(self, dt):
+        from rift_model import GEO
+        Model = self.Model
+        self.attach()
+        threshold = GEO.nd(self.threshold)
+        step = self._max_speed(Model) * dt
+        #Counts the steps on both sides of the rebuild, whether the swarm is
+        #advected before or after the surface processes run
+        self.displacement += step
+        if self.displacement >= GEO.nd(self.bandWidth):
+            self._rebuild(Model, threshold)
+            self.displacement = step
+
+        band = np.flatnonzero(self.inBand.data[:, 0])
+        below = band[self._swarm.particleCoordinates.data[band, 1] < threshold]
+        Model.materialField.data[below, 0] = self.sediment[0].index
+        self.inBand.data[below, 0] = 0
+
+
+class FreeSurfaceSedimentation(SedimentationThreshold):
+    """Sediment fill of a free surface model: wherever the deformed top boundary
+    is below the threshold it is raised to it, and the space opened between the
+    old and the new surface is filled with sediment particles."""
+
+    def __init__(self, Model, sediment, threshold, comm):
+        super(FreeSurfaceSedimentation, self).__init__(air=[], sediment=sediment, threshold=threshold)
+        self.mesh = Model.mesh
+        self.comm = comm
+        nx, ny = self.mesh.elementRes
+        gId = self.mesh.data_nodegId[:, 0]
+        self.column = gId % (nx + 1)
+        self.isTop = gId // (nx + 1) == ny
+
+    def _init_model(self):
+        #There is no air to map to sediment
+        pass
+
+    def _surface(self):
+        """x and height of every top boundary node, in column order, on all ranks."""
+        nx = self.mesh.elementRes[0]
+        local = np.full((2, nx + 1), -np.inf)
+        local[:, self.column[self.isTop]] = self.mesh.data[self.isTop].T
+        surface = np.empty_like(local)
+        self.comm.Allreduce(local, surface, op=MPI.MAX)
+        return surface
+
+    def _fill_particles(self, x, oldTop, newTop, perSide):
+        """Particle coordinates filling the space between oldTop and newTop."""
+        from rift_model import GEO
+        dy = (GEO.nd(self.Model.maxCoord[1]) - GEO.nd(self.Model.minCoord[1])) / self.mesh.elementRes[1]
+        coords = []
+        s = (np.arange(perSide) + 0.5) / perSide
+        for e in np.flatnonzero((newTop[:-1] > oldTop[:-1]) | (newTop[1:] > oldTop[1:])):
+            thickness = max(newTop[e] - oldTop[e], newTop[e + 1] - oldTop[e + 1])
+            layers = int(np.ceil(perSide * thickness / dy))
+            t = (np.arange(layers) + 0.5) / layers
+            S, T = np.meshgrid(s, t, indexing="ij")
+            bottom = oldTop[e] + S * (oldTop[e + 1] - oldTop[e])
+            top = newTop[e] + S * (newTop[e + 1] - newTop[e])
+            coords.append(np.column_stack([(x[e] + S * (x[e + 1] - x[e])).ravel(),
+                                           (bottom + T * (top - bottom)).ravel()]))
+        return np.concatenate(coords)
+
+    def solve(self, dt):
+        from rift_model import GEO
+        Model = self.Model
+        x, top = self._surface()
+        newTop = np.maximum(top, GEO.nd(self.threshold))
+        if not np.any(newTop > top):
+            return
+
+        #Stretch every column between the fixed bottom and its new top
+        bottom = GEO.nd(Model.minCoord[1])
+        scale = (newTop - bottom) / (top - bottom)
+        with self.mesh.deform_mesh():
+            self.mesh.data[:, 1] = bottom + (self.mesh.data[:, 1] - bottom) * scale[self.column]
+        Model.swarm.update_particle_owners()
+
+        coords = self._fill_particles(x, top, newTop, particles_per_side(Model))
+        local = Model.swarm.add_particles_with_coordinates(np.ascontiguousarray(coords))
+        Model.materialField.data[local[local >= 0], 0] = self.sediment[0].index
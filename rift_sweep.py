@@ -0,0 +1,223 @@
+# Parameter sweep driver: runs several rift model variants inside one allocation.
+#
+#   python rift_sweep.py sweep.json --np 48
+#   python rift_sweep.py sweep.json --status
+#   python rift_sweep.py sweep.json --np 4 --check
+#
+# Underworld's C layer builds its meshes, decompositions and swarms on
+# MPI_COMM_WORLD, so sweep members can not share one MPI job on split
+# communicators. The driver, run without mpirun inside the allocation, starts
+# one "mpirun -np <np> python rift_sweep.py sweep.json --member <name>" per
+# member at once and waits for them. Every member is its own MPI job, running
+# its own spec-driven model, with its log in <outputDir>/logs/<name>.log.
+# --check builds every member and writes one checkpoint of it without running.
+#
+# sweep.json looks like
+#   {"base": "Narrow_Rift", "outputDir": "Sweep_Velocity",
+#    "members": [{"name": "v1", "velocity": -1.0},
+#                {"name": "v2", "velocity": -2.0, "maxDamage": 0.5}]}
+# Member keys are any of the rift_spec() arguments (radiogenicHeatProd,
+# lithosphereBase, duration, crustL3Density) plus velocity (cm/yr) and maxDamage.
+# "freeSurface": true runs every member without the sticky air (rift_model.free_surface).
+#Written by Youseph Ibrahim
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from rift_variants import SPEC_ARGUMENTS, VARIANTS
+
+
+def load_sweep(path):
+    with open(path) as f:
+        sweep = json.load(f)
+    names = [member["name"] for member in sweep["members"]]
+    if len(set(names)) != len(names):
+        raise ValueError("Sweep member names must be unique")
+    return sweep
+
+
+def member_spec(sweep, member):
+    """Model spec for one sweep member, writing to its own output directory."""
+    from rift_model import free_surface, rift_spec
+
+    arguments = dict(VARIANTS[sweep.get("base", "Narrow_Rift")])
+    arguments.update({key: member[key] for key in SPEC_ARGUMENTS if key in member})
+    outputDir = os.path.join(sweep["outputDir"], member["name"])
+    spec = rift_spec(member["name"], outputDir, **arguments)
+    if "velocity" in member:
+        spec["velocity"] = (member["velocity"], "centimeter / year")
+    if "maxDamage" in member:
+        spec["damage"]["maxDamage"] = member["maxDamage"]
+    if sweep.get("freeSurface"):
+        spec = free_surface(spec)
+    return spec
+
+
+def check_checkpoint(Model, comm):
+    """Write checkpoint 0 of Model and raise unless its swarm file holds every
+    particle of the model."""
+    import h5py
+    from mpi4py import MPI
+    from rift_post import iter_checkpoints
+    Model.checkpoint(0)
+    particles = comm.allreduce(Model.swarm.particleLocalCount, op=MPI.SUM)
+    if comm.rank == 0:
+        checkpoint = [checkpoint for checkpoint in iter_checkpoints(Model.outputDir) if "swarm" in checkpoint][-1]
+        with h5py.File(checkpoint.files["swarm"], "r") as f:
+            rows = f["data"].shape[0]
+        if rows != particles:
+            raise RuntimeError("{0} holds {1} particles, the sweep member has {2}".format(
+                checkpoint.files["swarm"], rows, particles))
+    comm.Barrier()
+
+
+#Progress table, one small JSON file per member that is replaced atomically
+def _progress_path(outputDir, name):
+    return os.path.join(outputDir, "progress", name + ".json")
+
+
+def write_progress(outputDir, name, **status):
+    path = _progress_path(outputDir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    status["name"] = name
+    status["updated"] = time.time()
+    with open(path + ".tmp", "w") as f:
+        json.dump(status, f)
+    os.replace(path + ".tmp", path)
+
+
+def progress_table(sweep):
+    rows = []
+    for member in sweep["members"]:
+        try:
+            with open(_progress_path(sweep["outputDir"], member["name"])) as f:
+                rows.append(json.load(f))
+        except FileNotFoundError:
+            rows.append({"name": member["name"], "state": "pending"})
+    return rows
+
+
+def format_progress(rows):
+    lines = ["{0:<20} {1:<9} {2:>8} {3:>12} {4:>10}".format("member", "state", "step", "time (yr)", "wall (s)")]
+    for row in rows:
+        lines.append("{0:<20} {1:<9} {2:>8} {3:>12} {4:>10}".format(
+            row["name"], row["state"], row.get("step", ""),
+            "%.4g" % row["time"] if "time" in row else "",
+            "%.0f" % row["wall"] if "wall" in row else ""))
+    return "\n".join(lines)
+
+
+def find_member(sweep, name):
+    for member in sweep["members"]:
+        if member["name"] == name:
+            return member
+    raise ValueError("No sweep member called {0}".format(name))
+
+
+def run_member(sweep, member, comm):
+    from rift_model import build_model, run_model, model_time
+
+    spec = member_spec(sweep, member)
+    Model = build_model(spec)
+    start = time.time()
+
+    def report(state="running"):
+        if comm.rank == 0:
+            write_progress(sweep["outputDir"], member["name"], state=state, ranks=comm.size,
+                           step=int(Model.step), time=model_time(Model),
+                           wall=time.time() - start)
+
+    Model.post_solve_functions["Sweep progress"] = report
+    report("started")
+    try:
+        run_model(Model, spec)
+    except Exception:
+        report("failed")
+        raise
+    report("done")
+
+
+def check_member(sweep, member, comm):
+    """Build the model of member in <member output>/sweep_check and write one
+    checkpoint of it, without running it."""
+    from rift_model import build_model
+
+    spec = member_spec(sweep, member)
+    spec["outputDir"] = os.path.join(spec["outputDir"], "sweep_check")
+    Model = build_model(spec)
+    Model.init_model(temperature=False, pressure=False)
+    check_checkpoint(Model, comm)
+    if comm.rank == 0:
+        write_progress(sweep["outputDir"], member["name"], state="checked", ranks=comm.size)
+
+
+def member_commands(path, sweep, nprocs, check=False, mpirun="mpirun"):
+    """One MPI launch of this script per member of the sweep in path."""
+    commands = []
+    for member in sweep["members"]:
+        command = [mpirun, "-np", str(nprocs), sys.executable, os.path.abspath(__file__), path,
+                   "--member", member["name"]]
+        if check:
+            command.append("--check")
+        commands.append(command)
+    return commands
+
+
+def launch_members(path, sweep, nprocs, check=False, mpirun="mpirun"):
+    """Run every member of the sweep as its own MPI job, all at once, and
+    return the names of the members that failed."""
+    logs = os.path.join(sweep["outputDir"], "logs")
+    os.makedirs(logs, exist_ok=True)
+    running = []
+    for member, command in zip(sweep["members"], member_commands(path, sweep, nprocs, check, mpirun)):
+        log = open(os.path.join(logs, member["name"] + ".log"), "a")
+        running.append((member["name"], subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT), log))
+    failed = []
+    for name, process, log in running:
+        if process.wait() != 0:
+            failed.append(name)
+        log.close()
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a sweep of rift model variants in one allocation")
+    parser.add_argument("sweep", help="JSON file describing the sweep members")
+    parser.add_argument("--status", action="store_true", help="print the progress table and exit")
+    parser.add_argument("--check", action="store_true",
+                        help="only build every member and write one checkpoint of it")
+    parser.add_argument("--np", type=int, help="MPI ranks of every member")
+    parser.add_argument("--mpirun", default="mpirun", help="MPI launcher of the members")
+    parser.add_argument("--member", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    sweep = load_sweep(args.sweep)
+    if args.status:
+        print(format_progress(progress_table(sweep)))
+        return
+
+    if args.member is not None:
+        #One member, launched by the driver under mpirun
+        import underworld as uw
+        member = find_member(sweep, args.member)
+        if args.check:
+            check_member(sweep, member, uw.mpi.comm)
+        else:
+            run_member(sweep, member, uw.mpi.comm)
+        return
+
+    if not args.np:
+        parser.error("--np is required to launch the sweep members")
+    failed = launch_members(args.sweep, sweep, args.np, args.check, args.mpirun)
+    print(format_progress(progress_table(sweep)))
+    if failed:
+        sys.exit("Sweep members failed: {0}, see {1}".format(
+            ", ".join(failed), os.path.join(sweep["outputDir"], "logs")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# Lagged thermal solve.
+#
+# Thermal diffusion is far slower than the CFL limited mechanical time step, yet
+# the SLCN advection-diffusion system is integrated every step. LaggedThermalSolve
+# replaces its integrate() so the temperature is only advanced every "every"
+# steps with the dt accumulated since the last solve, or earlier once the
+# estimated temperature change reaches maxChange (heating accumulated so far plus
+# the largest advective change, max|v| max|grad T| times the accumulated dt).
+#
+# The heat sources (shear heating and radiogenic heat) are accumulated every
+# step as the sum of source * dt at the nodes. Before the lagged solve, which
+# applies the current source over the whole accumulated dt, the temperature gets
+# the difference between the two, so the heat put in is the one of the steps
+# actually taken. The pending solve is also flushed before every checkpoint
+# (through the pre_checkpoint_functions of rift_output), so checkpointed
+# temperatures are up to date.
+#
+# UWGeodynamics 2.13 builds a new advection-diffusion system every time
+# Model._advdiffSystem is read, so nothing set on the system it returns outlives
+# the step. keep_advdiff_system() makes the property build it once (and again
+# when a restart replaces Model.swarm) and routes its integrate() through the
+# named wrappers of add_integrate_wrapper(). LaggedThermalSolve is one of them
+# and takes the source from Model.HeatProdFn, which the property sets. Without
+# that source the heating could not be kept conservative, so it raises instead
+# of lagging the solve.
+#Written by Youseph Ibrahim
+
+import functools
+from collections import OrderedDict
+
+import numpy as np
+from mpi4py import MPI
+
+from rift_output import wrap_checkpoints
+
+#Model attribute holding the system kept by keep_advdiff_system
+KEPT_SYSTEM = "_keptAdvdiffSystem"
+
+
+def _kept_property(build):
+    """_advdiffSystem property returning the kept system of models that have one."""
+    def advdiffSystem(self):
+        kept = self.__dict__.get(KEPT_SYSTEM)
+        if kept is None:
+            return build(self)
+        if kept["swarm"] is not self.swarm:
+            system = build(self)
+            kept["swarm"], kept["system"] = self.swarm, system
+            integrate = system.integrate
+
+            def wrapped(dt, *args, **kwargs):
+                call = integrate
+                for wrapper in reversed(list(kept["wrappers"].values())):
+                    call = functools.partial(wrapper, call)
+                return call(dt, *args, **kwargs)
+            system.integrate = wrapped
+        return kept["system"]
+    advdiffSystem.build = build
+    return property(advdiffSystem)
+
+
+def keep_advdiff_system(Model):
+    """Make Model._advdiffSystem return the same system from now on, rebuilt only
+    once Model.swarm is replaced, and return its record {"swarm", "system", "wrappers"}."""
+    kept = Model.__dict__.get(KEPT_SYSTEM)
+    if kept is not None:
+        return kept
+    for klass in type(Model).__mro__:
+        prop = klass.__dict__.get("_advdiffSystem")
+        if prop is not None:
+            break
+    if not isinstance(prop, property):
+        raise AttributeError("Model has no _advdiffSystem property, keeping the advection-diffusion system "
+                             "needs UWGeodynamics 2.13")
+    if not hasattr(prop.fget, "build"):
+        setattr(klass, "_advdiffSystem", _kept_property(prop.fget))
+    kept = {"swarm": None, "system": None, "wrappers": OrderedDict()}
+    setattr(Model, KEPT_SYSTEM, kept)
+    return kept
+
+
+def add_integrate_wrapper(Model, name, wrapper):
+    """Call wrapper(integrate, dt, *args, **kwargs) in place of every integrate()
+    of the advection-diffusion system of Model, integrate being the next wrapper
+    or the system's own integrate. Wrappers added first are called first."""
+    keep_advdiff_system(Model)["wrappers"][name] = wrapper
+
+
+def remove_integrate_wrapper(Model, name):
+    kept = Model.__dict__.get(KEPT_SYSTEM)
+    if kept is not None:
+        kept["wrappers"].pop(name, None)
+
+
+def fixed_temperature_nodes(Model, spec):
+    """Mask of the local nodes with a fixed temperature: the top and bottom
+    walls and the node sets of spec["temperatureBCs"]."""
+    mesh = Model.mesh
+    fixed = np.zeros(len(mesh.data), dtype=bool)
+    for name in ("MinJ_VertexSet", "MaxJ_VertexSet"):
+        fixed[mesh.specialSets[name].data] = True
+    for name, _ in spec["temperatureBCs"].get("nodeSets", ()):
+        fixed |= Model.materials_by_name[name].shape.fn.evaluate(mesh)[:, 0].astype(bool)
+    return fixed
+
+
+class LaggedThermalSolve(object):
+    """Runs the thermal solve of Model every few steps with conservative heating."""
+
+    def __init__(self, Model, spec, comm):
+        from rift_model import GEO, _q
+        options = spec["thermalLag"]
+        self.Model = Model
+        self.comm = comm
+        self.every = options["every"]
+        self.maxChange = GEO.nd(_q(options["maxChange"]))
+        self.fixed = fixed_temperature_nodes(Model, spec)
+        self.kept = keep_advdiff_system(Model)
+        self.system = None
+        self._integrate = None
+        self.solves = 0
+        self.steps = 0
+        self._reset()
+        add_integrate_wrapper(Model, "Lagged thermal solve", self.integrate)
+        wrap_checkpoints(Model)
+        Model.pre_checkpoint_functions["Lagged thermal solve"] = self.flush
+
+    def _reset(self):
+        self.pending = 0.
+        self.pendingSteps = 0
+        self.heat = None
+
+    def _source(self):
+        source = getattr(self.Model, "HeatProdFn", None)
+        if source is None:
+            raise AttributeError("Model has no HeatProdFn, the heating of the lagged thermal solve "
+                                 "would not be conservative")
+        return source.evaluate(self.Model.mesh)[:, 0]
+
+    def _estimate(self):
+        """Largest temperature change the pending solve would make."""
+        velocity = self.Model.velocityField.data
+        gradient = self.Model.temperature.fn_gradient.evaluate(self.Model.mesh)
+        advection = (np.sqrt(np.max(np.sum(velocity * velocity, axis=1), initial=0.))
+                     * np.sqrt(np.max(np.sum(gradient * gradient, axis=1), initial=0.)) * self.pending)
+        heating = np.max(np.abs(self.heat), initial=0.) if np.ndim(self.heat) else abs(self.heat)
+        return self.comm.allreduce(float(advection + heating), op=MPI.MAX)
+
+    def integrate(self, integrate, dt, *args, **kwargs):
+        """Integrate wrapper of the kept advection-diffusion system."""
+        if self.kept["system"] is not self.system:
+            #A restart rebuilt the system and reloaded the temperature
+            self.system = self.kept["system"]
+            self._reset()
+        self._integrate = integrate
+        source = self._source()
+        self.heat = source * dt if self.heat is None else self.heat + source * dt
+        self.pending += dt
+        self.pendingSteps += 1
+        self.steps += 1
+        if self.pendingSteps >= self.every or self._estimate() >= self.maxChange:
+            return self.flush(source, *args, **kwargs)
+
+    def flush(self, source=None, *args, **kwargs):
+        """Advance the temperature over the pending dt."""
+        if not self.pendingSteps:
+            return
+        if source is None:
+            source = self._source()
+        #The solve adds source * pending, top it up to the heat of the steps taken
+        correction = self.heat - source * self.pending
+        if np.ndim(correction):
+            correction[self.fixed] = 0.
+            self.Model.temperature.data[:, 0] += correction
+        result = self._integrate(self.pending, *args, **kwargs)
+        self.solves += 1
+        self._reset()
+        return result
+
+    def close(self):
+        self.flush()
+        remove_integrate_wrapper(self.Model, "Lagged thermal solve")
+        self.Model.pre_checkpoint_functions.pop("Lagged thermal solve", None)
+        if self.comm.rank == 0:
+            print("{0} thermal solves in {1} steps".format(self.solves, self.steps))
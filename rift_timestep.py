@@ -0,0 +1,87 @@
+# Adaptive time stepping.
+#
+# UWGeodynamics takes dt as GEO.rcParams["CFL"] times the advective limit of
+# the current velocity field. TimeStepController is a post-solve hook that
+# adjusts that factor every step: it grows it while the Stokes solves converge
+# in few nonlinear iterations and the peak strain rate hardly changes, and
+# shrinks it when the iterations climb or the peak strain rate jumps (plastic
+# localisation speeding up). The factor always stays within [minCFL, maxCFL].
+# maxDt is not part of the factor: the run passes it to Model.run_for as dt,
+# which UWGeodynamics uses as an upper bound on every step. Every step appends
+# the decision and the reason for it to <outputDir>/timestep.jsonl.
+#Written by Youseph Ibrahim
+
+import json
+import os
+
+import numpy as np
+from mpi4py import MPI
+
+from rift_solver import IterationCounter
+
+
+class TimeStepController(object):
+    """Post-solve hook adapting GEO.rcParams["CFL"] from step to step."""
+
+    def __init__(self, Model, options, comm, path=None):
+        from rift_model import GEO
+        self.Model = Model
+        self.comm = comm
+        self.options = options
+        self.path = path or os.path.join(Model.outputDir, "timestep.jsonl")
+        self.cfl = float(GEO.rcParams["CFL"])
+        self.iterations = IterationCounter(Model, "Time step control")
+        self._strainRate = None
+        Model.post_solve_functions["Time step control"] = self
+
+    def _max_strain_rate(self):
+        local = np.max(self.Model.strainRate_2ndInvariant.evaluate(self.Model.mesh), initial=0.)
+        return self.comm.allreduce(float(local), op=MPI.MAX)
+
+    def _last_dt(self):
+        from rift_model import GEO, u
+        #Model.dt is an underworld constant function
+        return GEO.dimensionalise(self.Model.dt.value, u.year).magnitude
+
+    def decide(self, iterations, change):
+        """New CFL factor and the reason for it, from this step's nonlinear
+        iterations and relative change of the peak strain rate."""
+        options = self.options
+        cfl = self.cfl
+        if iterations >= options["highIterations"]:
+            cfl, reason = cfl * options["shrink"], "{0} nonlinear iterations".format(iterations)
+        elif change is not None and change >= options["localisationChange"]:
+            cfl, reason = cfl * options["shrink"], "peak strain rate up {0:.0%}".format(change)
+        elif iterations <= options["lowIterations"] and change is not None and abs(change) <= options["quietChange"]:
+            cfl, reason = cfl * options["grow"], "quiet step"
+        else:
+            reason = "hold"
+
+        if cfl > options["maxCFL"]:
+            cfl, reason = options["maxCFL"], reason + ", at maxCFL"
+        elif cfl < options["minCFL"]:
+            cfl, reason = options["minCFL"], reason + ", at minCFL"
+        return cfl, reason
+
+    def __call__(self):
+        from rift_model import GEO, model_time
+        iterations = self.iterations.take()
+        strainRate = self._max_strain_rate()
+        change = None
+        if self._strainRate:
+            change = strainRate / self._strainRate - 1.
+        self._strainRate = strainRate
+
+        cfl, reason = self.decide(iterations, change)
+        if self.comm.rank == 0:
+            record = {"step": int(self.Model.step), "time": model_time(self.Model), "dt": self._last_dt(),
+                      "nonlinear iterations": iterations, "peak strain rate change": change,
+                      "CFL": self.cfl, "next CFL": cfl, "reason": reason}
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        self.cfl = cfl
+        GEO.rcParams["CFL"] = cfl
+
+    def close(self):
+        self.Model.post_solve_functions.pop("Time step control", None)
+        self.iterations.remove()
@@ -0,0 +1,148 @@
+# Per-step performance instrumentation.
+#
+# StepTimer wraps the phases of the UWGeodynamics run loop (Stokes solve, surface
+# processes, swarm advection, population control, advection-diffusion) with
+# timers, reduces the per-rank timings to min/mean/max across ranks once per
+# step and appends them as one JSON line per step to
+# <outputDir>/performance.jsonl, with particle counts, nonlinear iterations and dt.
+# A phase with nothing to time is written as null and reported once on rank 0,
+# rather than as 0 s. The advection-diffusion system is timed through
+# rift_thermal.add_integrate_wrapper, as UWGeodynamics 2.13 builds a new one every
+# time Model._advdiffSystem is read.
+#Written by Youseph Ibrahim
+
+import json
+import os
+import time
+
+import numpy as np
+from mpi4py import MPI
+
+from rift_solver import IterationCounter
+from rift_thermal import add_integrate_wrapper, remove_integrate_wrapper
+
+#Phase name and the path from Model to the callables UWGeodynamics 2.13 calls for
+#it in the run loop, "*" standing for every value of a dict. Objects the run loop
+#replaces (Model.restart rebuilds the swarm advector and the passive tracers) are
+#looked up again every step.
+PHASES = [
+    ("stokes", "solve"),
+    ("surface processes", "surfaceProcesses.solve"),
+    ("swarm advection", "swarm_advector.integrate"),
+    ("population control", "population_control.repopulate"),
+    ("advection-diffusion", None),
+    ("passive tracers", "passive_tracers.*.advector.integrate"),
+]
+
+
+def _targets(obj, path):
+    """(object, attribute name) of every callable path leads to from obj."""
+    *parents, name = path.split(".")
+    objs = [obj]
+    for parent in parents:
+        if parent == "*":
+            objs = [value for o in objs for value in o.values()]
+        else:
+            objs = [getattr(o, parent, None) for o in objs]
+        objs = [o for o in objs if o is not None]
+    return [(o, name) for o in objs if callable(getattr(o, name, None))]
+
+
+class StepTimer(object):
+    """Times the run loop of Model and writes one record per step."""
+
+    def __init__(self, Model, comm, path=None):
+        self.Model = Model
+        self.comm = comm
+        self.path = path or os.path.join(Model.outputDir, "performance.jsonl")
+        self.names = [name for name, _ in PHASES]
+        self.elapsed = dict.fromkeys(self.names, 0.0)
+        self.iterations = IterationCounter(Model, "Step timer")
+        self._resolved = {"advection-diffusion"}
+        self._reported = False
+        self._stepStart = None
+        self._step = None
+        self._wrap()
+        add_integrate_wrapper(Model, "Step timer", self._timed_integrate)
+        Model.pre_solve_functions["Step timer"] = self.start_step
+
+    def _timed(self, phase, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.elapsed[phase] += time.perf_counter() - start
+        timed.__wrapped__ = function
+        timed.phase = phase
+        return timed
+
+    def _timed_integrate(self, integrate, *args, **kwargs):
+        return self._timed("advection-diffusion", integrate)(*args, **kwargs)
+
+    def _wrap(self):
+        for phase, path in PHASES:
+            if path is None:
+                continue
+            for obj, name in _targets(self.Model, path):
+                self._resolved.add(phase)
+                function = getattr(obj, name)
+                if getattr(function, "phase", None) != phase:
+                    setattr(obj, name, self._timed(phase, function))
+
+    def start_step(self):
+        now = time.perf_counter()
+        if self._stepStart is not None:
+            self.write_step(now - self._stepStart)
+        self._stepStart = now
+        #Model.step has moved on by the time the record of this step is written
+        self._step = int(self.Model.step)
+        #Objects the run loop created since the last step get wrapped too
+        self._wrap()
+
+    def _dt(self):
+        from rift_model import GEO, u
+        #Model.dt is an underworld constant function
+        return GEO.dimensionalise(self.Model.dt.value, u.year).magnitude
+
+    def write_step(self, wall):
+        from rift_model import model_time
+        local = np.array([self.elapsed[name] for name in self.names] + [wall])
+        low = np.empty_like(local)
+        high = np.empty_like(local)
+        total = np.empty_like(local)
+        self.comm.Allreduce(local, low, op=MPI.MIN)
+        self.comm.Allreduce(local, high, op=MPI.MAX)
+        self.comm.Allreduce(local, total, op=MPI.SUM)
+        #Phases timed on every rank
+        found = np.array([name in self._resolved for name in self.names] + [True], dtype=np.int32)
+        timed = np.empty_like(found)
+        self.comm.Allreduce(found, timed, op=MPI.MIN)
+        particles = self.comm.allreduce(self.Model.swarm.particleLocalCount, op=MPI.SUM)
+        iterations = self.iterations.take()
+        for name in self.names:
+            self.elapsed[name] = 0.0
+
+        if self.comm.rank != 0:
+            return
+        mean = total / self.comm.size
+        record = {"step": self._step, "time": model_time(self.Model), "dt": self._dt(),
+                  "nonlinear iterations": iterations, "particles": particles,
+                  "timings": {name: {"min": low[i], "mean": mean[i], "max": high[i]} if timed[i] else None
+                              for i, name in enumerate(self.names + ["step"])}}
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        missing = [name for i, name in enumerate(self.names) if not timed[i]]
+        if missing and not self._reported:
+            print("Step timer: nothing to time for {0}, written as null in {1}".format(
+                ", ".join(missing), self.path))
+            self._reported = True
+
+    def close(self):
+        """Write the last step and unhook from the model."""
+        if self._stepStart is not None:
+            self.write_step(time.perf_counter() - self._stepStart)
+            self._stepStart = None
+        self.Model.pre_solve_functions.pop("Step timer", None)
+        remove_integrate_wrapper(self.Model, "Step timer")
+        self.iterations.remove()
@@ -0,0 +1,17 @@
+# The rift variants, as arguments of rift_model.rift_spec().
+#
+# Kept free of underworld so the sweep driver can read them without starting
+# MPI before it launches the members (see rift_sweep.py).
+#Written by Youseph Ibrahim
+
+#Arguments of rift_spec() a variant may set
+SPEC_ARGUMENTS = ("radiogenicHeatProd", "lithosphereBase", "duration", "crustL3Density")
+
+#radiogenicHeatProd in W/m^3, lithosphereBase in km, duration in years
+VARIANTS = {
+    "Narrow_Rift": {"radiogenicHeatProd": 0.88e-6, "lithosphereBase": -110., "duration": 8010000},
+    "Wide_Rift": {"radiogenicHeatProd": 1.15e-6, "lithosphereBase": -76., "duration": 2000000,
+                  "crustL3Density": 2675.},
+}
+
+OUTPUT_DIRS = {"Narrow_Rift": "Inversion_Narrow_Rift", "Wide_Rift": "Inversion_Wide_Rift"}
@@ -0,0 +1,179 @@
+# Coarse-to-fine warm start.
+#
+#   mpirun -np 24 python rift_warmstart.py Narrow_Rift --phase coarse
+#   mpirun -np 192 python rift_warmstart.py Narrow_Rift --phase fine
+#
+# The first few hundred kyr of a run are mostly thermal and mechanical
+# adjustment. The coarse phase runs them on a mesh coarsened by
+# spec["warmStart"]["factor"] (on as many ranks as suit that mesh) and writes a
+# rank independent handoff file, <outputDir>/warm_start.h5. The fine phase builds
+# and initialises the production model, then takes the temperature (bilinear
+# interpolation between the coarse nodes), the material index and plasticStrain
+# (from the nearest coarse particle), the tracer positions and the model time
+# from the handoff file and runs the rest of spec["duration"].
+#Written by Youseph Ibrahim
+
+import argparse
+import copy
+import os
+
+import h5py
+import numpy as np
+from scipy.spatial import cKDTree
+
+HANDOFF_FILE = "warm_start.h5"
+
+
+def handoff_path(spec):
+    return os.path.join(spec["outputDir"], HANDOFF_FILE)
+
+
+def coarse_spec(spec):
+    """The spec of the coarse phase: every element size multiplied by factor, run
+    for the warm start duration in <outputDir>/warm_start."""
+    options = spec["warmStart"]
+    factor = options["factor"]
+    coarse = copy.deepcopy(spec)
+    coarse["name"] = spec["name"] + "_coarse"
+    coarse["outputDir"] = os.path.join(spec["outputDir"], "warm_start")
+    coarse["resolution"] = [max(res // factor, 1) for res in spec["resolution"]]
+    for params in (coarse.get("meshRefinement") or {}).values():
+        params["size"] = (params["size"][0] * factor, params["size"][1])
+        params["maxSize"] = (params["maxSize"][0] * factor, params["maxSize"][1])
+    coarse["duration"] = options["duration"]
+    coarse["warmStart"] = None
+    return coarse
+
+
+def _gather(comm, array):
+    data = comm.gather(np.array(array), root=0)
+    return None if comm.rank != 0 else np.concatenate(data)
+
+
+def write_handoff(Model, path, comm):
+    """Write the state the fine phase needs, in global (rank independent) order."""
+    from rift_model import model_time
+    from rift_output import gather_mesh_field, gather_tracers
+    mesh = gather_mesh_field(Model.mesh, Model.mesh, comm)
+    temperature = gather_mesh_field(Model.mesh, Model.temperature, comm)
+    particles = _gather(comm, Model.swarm.particleCoordinates.data)
+    material = _gather(comm, Model.materialField.data[:, 0])
+    strain = _gather(comm, Model.plasticStrain.data[:, 0])
+    tracers = {name: gather_tracers(tracers, comm) for name, tracers in Model.tracers_by_name.items()}
+    if comm.rank != 0:
+        return
+
+    with h5py.File(path + ".tmp", "w") as f:
+        f.attrs["time"] = model_time(Model)
+        f.attrs["step"] = int(Model.step)
+        f.attrs["elementRes"] = Model.mesh.elementRes
+        f["mesh"] = mesh
+        f["temperature"] = temperature[:, 0]
+        f["particles"] = particles
+        f["material"] = material
+        f["plasticStrain"] = strain
+        for name, coords in tracers.items():
+            f["tracers/" + name] = coords
+    os.replace(path + ".tmp", path)
+
+
+def interpolate_nodal(xs, ys, values, coords):
+    """Bilinear interpolation of nodal values on the rectilinear grid xs x ys."""
+    i = np.clip(np.searchsorted(xs, coords[:, 0]) - 1, 0, len(xs) - 2)
+    j = np.clip(np.searchsorted(ys, coords[:, 1]) - 1, 0, len(ys) - 2)
+    s = np.clip((coords[:, 0] - xs[i]) / (xs[i + 1] - xs[i]), 0., 1.)
+    t = np.clip((coords[:, 1] - ys[j]) / (ys[j + 1] - ys[j]), 0., 1.)
+    return ((1. - s) * (1. - t) * values[j, i] + s * (1. - t) * values[j, i + 1]
+            + (1. - s) * t * values[j + 1, i] + s * t * values[j + 1, i + 1])
+
+
+def apply_handoff(Model, path):
+    """Put the coarse phase state of path onto the initialised fine Model."""
+    from rift_model import u
+    from rift_state import OUTSIDE
+    with h5py.File(path, "r") as f:
+        nx, ny = f.attrs["elementRes"]
+        mesh = f["mesh"][...].reshape(ny + 1, nx + 1, 2)
+        temperature = f["temperature"][...].reshape(ny + 1, nx + 1)
+        particles = f["particles"][...]
+        material = f["material"][...]
+        strain = f["plasticStrain"][...]
+        tracers = {name: f["tracers"][name][...] for name in f["tracers"]}
+        time, step = f.attrs["time"], int(f.attrs["step"])
+
+    #The coarse mesh is rectilinear (uniform or graded), read its axes off the first row and column
+    Model.temperature.data[:, 0] = interpolate_nodal(mesh[0, :, 0], mesh[:, 0, 1], temperature, Model.mesh.data)
+
+    #Nearest coarse particle, searched among those close to this rank's part of the domain
+    coords = Model.swarm.particleCoordinates.data
+    if len(coords):
+        margin = 2. * np.max(np.diff(mesh[0, :, 0]))
+        near = np.flatnonzero(np.all((particles >= coords.min(axis=0) - margin)
+                                     & (particles <= coords.max(axis=0) + margin), axis=1))
+        _, nearest = cKDTree(particles[near]).query(coords)
+        Model.materialField.data[:, 0] = material[near[nearest]]
+        Model.plasticStrain.data[:, 0] = strain[near[nearest]]
+
+    for name, positions in tracers.items():
+        swarm = Model.tracers_by_name[name]
+        with swarm.deform_swarm():
+            moved = positions[swarm.tracerId.data[:, 0]]
+            #Tracers that left the coarse model leave this one too
+            moved[np.isnan(moved[:, 0])] = OUTSIDE
+            swarm.data[:] = moved
+        swarm.update_particle_owners()
+
+    Model.time = time * u.year
+    Model.step = step
+
+
+def has_checkpoints(spec, nprocs):
+    """Whether the run of spec has HDF5 checkpoints or restart snapshots of its own to continue from."""
+    from rift_output import complete_checkpoints
+    from rift_post import iter_checkpoints
+    if spec.get("asyncCheckpoints") and complete_checkpoints(spec["outputDir"], nprocs):
+        return True
+    return os.path.isdir(spec["outputDir"]) and next(iter_checkpoints(spec["outputDir"]), None) is not None
+
+
+def warm_start(Model, spec, comm):
+    """Apply the handoff of the coarse phase to the freshly initialised Model,
+    unless the fine run already has checkpoints. Returns whether it did."""
+    if not spec.get("warmStart") or has_checkpoints(spec, comm.size):
+        return False
+    path = handoff_path(spec)
+    if not os.path.exists(path):
+        raise IOError("No warm start handoff at {0}, run the coarse phase first "
+                      "(python rift_warmstart.py <model> --phase coarse)".format(path))
+    apply_handoff(Model, path)
+    return True
+
+
+def run_phase(spec, phase):
+    import underworld as uw
+    from rift_model import build_model, run_model
+    if phase == "coarse":
+        coarse = coarse_spec(spec)
+        Model = build_model(coarse)
+        run_model(Model, coarse)
+        write_handoff(Model, handoff_path(spec), uw.mpi.comm)
+    else:
+        Model = build_model(spec)
+        run_model(Model, spec)
+
+
+def main(argv=None):
+    from rift_model import SPECS, WARM_START, variant
+    parser = argparse.ArgumentParser(description="Run the coarse or the fine phase of a warm started model")
+    parser.add_argument("model", choices=sorted(SPECS))
+    parser.add_argument("--phase", choices=("coarse", "fine"), required=True)
+    args = parser.parse_args(argv)
+
+    spec = SPECS[args.model]
+    if not spec.get("warmStart"):
+        spec = variant(spec, warmStart=WARM_START)
+    run_phase(spec, args.phase)
+
+
+if __name__ == "__main__":
+    main()
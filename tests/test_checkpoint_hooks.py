@@ -0,0 +1,86 @@
+import os
+
+from rift_output import wrap_checkpoints
+
+
+class _CheckpointFunction(object):
+    """The order of UWGeodynamics 2.13's _CheckpointFunction: run_for's periodic
+    checkpoint() writes the fields, the tracers and then the swarm,
+    checkpoint_all() (Model.checkpoint) the fields, the swarm and the tracers."""
+
+    def __init__(self, Model):
+        self.Model = Model
+
+    def checkpoint(self):
+        self.Model.checkpointID += 1
+        self.checkpoint_fields(checkpointID=self.Model.checkpointID)
+        self.checkpoint_tracers(checkpointID=self.Model.checkpointID)
+        self.checkpoint_swarm(checkpointID=self.Model.checkpointID)
+
+    def checkpoint_all(self, checkpointID=None):
+        self.checkpoint_fields(checkpointID=checkpointID)
+        self.checkpoint_swarm(checkpointID=checkpointID)
+        self.checkpoint_tracers(checkpointID=checkpointID)
+
+    def checkpoint_fields(self, fields=None, checkpointID=None):
+        self.Model.log.append("fields")
+
+    def checkpoint_swarm(self, fields=None, checkpointID=None):
+        self.Model.log.append("swarm")
+
+    def checkpoint_tracers(self, tracers=None, checkpointID=None):
+        self.Model.log.append("tracers")
+
+
+class Model(object):
+    """Model.checkpoint and Model.restart as in UWGeodynamics 2.13."""
+
+    def __init__(self, outputDir):
+        self.outputDir = outputDir
+        self.checkpointID = 0
+        self.swarm = object()
+        self.log = []
+
+    def checkpoint(self, checkpointID, variables=None, time=None, outputDir=None):
+        _CheckpointFunction(self).checkpoint_all(checkpointID)
+
+    def restart(self, step, restartDir=None):
+        if not step:
+            return
+        restartDir = restartDir if restartDir else self.outputDir
+        if not os.path.exists(restartDir) or not os.listdir(restartDir):
+            return
+        self.swarm = object()
+
+
+def _hooked(outputDir):
+    model = Model(str(outputDir))
+    wrap_checkpoints(model)
+    model.pre_checkpoint_functions["test"] = lambda: model.log.append("pre")
+    model.post_checkpoint_functions["test"] = lambda: model.log.append("post")
+    model.post_restart_functions["test"] = lambda restartDir: model.log.append(("restart", restartDir))
+    return model
+
+
+def test_run_for_checkpoints_call_the_hooks(tmp_path):
+    model = _hooked(tmp_path)
+    _CheckpointFunction(model).checkpoint()
+    assert model.log == ["pre", "fields", "tracers", "post", "swarm"]
+
+
+def test_model_checkpoint_calls_the_hooks(tmp_path):
+    model = _hooked(tmp_path)
+    model.checkpoint(3)
+    assert model.log == ["pre", "fields", "swarm", "tracers", "post"]
+
+
+def test_restart_hooks_only_after_loading(tmp_path):
+    model = _hooked(tmp_path)
+    #Fresh run: restartStep=-1 into an empty output directory
+    model.restart(-1, str(tmp_path))
+    model.restart(None, str(tmp_path))
+    model.restart(-1, str(tmp_path / "missing"))
+    assert model.log == []
+    (tmp_path / "swarm-1.h5").write_bytes(b"")
+    model.restart(-1, str(tmp_path))
+    assert model.log == [("restart", str(tmp_path))]
@@ -0,0 +1,53 @@
+import numpy as np
+
+import rift_damage
+from rift_damage import damage_field, hashed_uniform
+
+
+def _particles(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(0., 1., n), rng.uniform(-0.3, 0.05, n)])
+
+
+def _damage(coords):
+    out = np.empty(len(coords))
+    damage_field(coords, 0.25, (0.5, -0.05), 0.01, 1.0, 0.0, 1, out)
+    return out
+
+
+def test_uniform_range():
+    values = hashed_uniform(_particles(), 1)
+    assert values.min() >= 0. and values.max() < 1.
+    assert abs(values.mean() - 0.5) < 0.02
+
+
+def test_seed_changes_values():
+    coords = _particles()
+    assert not np.array_equal(hashed_uniform(coords, 1), hashed_uniform(coords, 2))
+
+
+def test_same_damage_on_any_split_and_order():
+    coords = _particles()
+    whole = _damage(coords)
+
+    #The particles shuffled and dealt out to 7 "ranks" of uneven size
+    order = np.random.default_rng(1).permutation(len(coords))
+    parts = np.array_split(order, [100, 900, 1000, 2500, 2501, 4000])
+    split = np.empty(len(coords))
+    for part in parts:
+        split[part] = _damage(coords[part])
+    assert np.array_equal(whole, split)
+
+
+def test_same_damage_across_chunks(monkeypatch):
+    coords = _particles()
+    whole = _damage(coords)
+    monkeypatch.setattr(rift_damage, "DAMAGE_CHUNK", 97)
+    assert np.array_equal(whole, _damage(coords))
+
+
+def test_no_damage_above_surface():
+    coords = _particles()
+    damage = _damage(coords)
+    assert np.all(damage[coords[:, 1] > 0.] == 0.)
+    assert np.all(damage[coords[:, 1] <= 0.] <= 0.25)
@@ -0,0 +1,53 @@
+import json
+import sys
+import types
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+
+import rift_diagnostics
+from rift_diagnostics import DiagnosticsHook
+
+
+class Comm(object):
+    rank, size = 0, 1
+
+
+class Model(object):
+    def __init__(self, outputDir, time):
+        self.outputDir = outputDir
+        self.time = time
+        self.step = int(time // 1000)
+        self.pre_solve_functions = OrderedDict()
+
+
+def _run(monkeypatch, outputDir, start, end):
+    """Run from start to end (yr) in steps of 1000 yr, diagnostics every 1000 yr."""
+    monkeypatch.setitem(sys.modules, "rift_model", types.SimpleNamespace(
+        model_time=lambda Model: Model.time,
+        _q=lambda value: types.SimpleNamespace(to=lambda unit: types.SimpleNamespace(magnitude=value[0]))))
+    monkeypatch.setitem(rift_diagnostics.DIAGNOSTICS, "test", lambda Model, spec, comm: {
+        "scalars": {"value": Model.time}, "profiles": {"profile": np.full(3, Model.time)}})
+    model = Model(str(outputDir), start)
+    hook = DiagnosticsHook(model, {"diagnostics": {"names": ["test"], "every": (1000., "year")}}, Comm())
+    while model.time < end:
+        for function in model.pre_solve_functions.values():
+            function()
+        model.time += 1000.
+        model.step += 1
+        hook()
+
+
+def test_restart_drops_the_rows_past_the_restart(monkeypatch, tmp_path):
+    _run(monkeypatch, tmp_path, 0., 4000.)
+    #Restart from the checkpoint at 2000 yr
+    _run(monkeypatch, tmp_path, 2000., 5000.)
+    with open(str(tmp_path / "diagnostics.jsonl")) as f:
+        records = [json.loads(line) for line in f]
+    assert [record["time"] for record in records] == [1000., 2000., 3000., 4000., 5000.]
+    assert [record["step"] for record in records] == [1, 2, 3, 4, 5]
+    with h5py.File(str(tmp_path / "diagnostics.h5"), "r") as f:
+        assert list(f["time"][...]) == [1000., 2000., 3000., 4000., 5000.]
+        assert f["profile"].shape == (5, 3)
+        assert f["profile"][2, 0] == 3000.
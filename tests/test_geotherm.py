@@ -0,0 +1,55 @@
+import numpy as np
+
+from rift_geotherm import _material_at, steady_profile
+
+#Lower layer without heat production up to a, upper layer with source s2, in SI units
+L, a = 100e3, 60e3
+KAPPA1, KAPPA2 = 1e-6, 2e-6
+S2 = 1e-6 / (2700. * 1000.)
+T0, T1 = 1600., 300.
+
+
+def analytic(y):
+    """Steady state of d/dy(kappa dT/dy) + source = 0 with T(0) = T0 and T(L) = T1."""
+    flux = (T1 - T0 + S2 * (L - a)**2 / (2. * KAPPA2)) / (a / KAPPA1 + (L - a) / KAPPA2)
+    Ta = T0 + flux * a / KAPPA1
+    upper = Ta + (flux * (y - a) - 0.5 * S2 * (y - a)**2) / KAPPA2
+    return np.where(y <= a, T0 + flux * y / KAPPA1, upper)
+
+
+def _cells(y):
+    layers = [(0., a, {}), (a, L, {})]
+    cell = _material_at(layers, 0.5 * (y[1:] + y[:-1]))
+    return np.where(cell == 0, KAPPA1, KAPPA2), np.where(cell == 0, 0., S2)
+
+
+def _fixed(y):
+    fixed = np.full(len(y), np.nan)
+    fixed[0], fixed[-1] = T0, T1
+    return fixed
+
+
+def test_two_layers_match_analytic_profile():
+    y = np.linspace(0., L, 41)
+    kappa, source = _cells(y)
+    assert np.allclose(steady_profile(y, kappa, source, _fixed(y)), analytic(y), rtol=0., atol=1e-8)
+
+
+def test_graded_nodes_match_analytic_profile():
+    #Finer towards the layer boundary, still with a node on it
+    y = np.unique(np.concatenate([a - (a * np.linspace(0., 1., 13))**1.5 / a**0.5,
+                                  a + ((L - a) * np.linspace(0., 1., 9))**2 / (L - a)]))
+    kappa, source = _cells(y)
+    assert np.allclose(steady_profile(y, kappa, source, _fixed(y)), analytic(y), rtol=0., atol=1e-8)
+
+
+def test_limit_holds_free_nodes():
+    y = np.linspace(0., L, 41)
+    kappa, source = _cells(y)
+    free = steady_profile(y, kappa, source, _fixed(y))
+    limit = np.full(len(y), np.inf)
+    limit[y < a] = 1400.
+    limited = steady_profile(y, kappa, source, _fixed(y), limit)
+    assert np.all(limited[1:][y[1:] < a] <= 1400. + 1e-9)
+    assert limited[0] == T0
+    assert np.any(free[y < a] > 1400.)
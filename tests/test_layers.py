@@ -0,0 +1,41 @@
+import numpy as np
+
+from rift_layers import layer_indices
+
+#Air above 0, two layers down to -10, a gap, and a last layer from -12 to -20
+LAYERS = [(0., 30., 1), (-4., 0., 2), (-10., -4., 3), (-20., -12., 4)]
+
+
+def test_inside_layers():
+    y = np.array([10., -1., -7., -15.])
+    assert layer_indices(LAYERS, y).tolist() == [1, 2, 3, 4]
+
+
+def test_boundary_goes_to_lower_layer():
+    y = np.array([0., -4., -12.])
+    assert layer_indices(LAYERS, y).tolist() == [2, 3, 4]
+
+
+def test_bottom_of_a_layer_without_one_below():
+    y = np.array([-10., -20.])
+    assert layer_indices(LAYERS, y).tolist() == [3, 4]
+
+
+def test_outside_layers():
+    y = np.array([31., -11., -12. + 1e-9, -20. - 1e-9])
+    assert layer_indices(LAYERS, y).tolist() == [-1, -1, -1, -1]
+
+
+def test_order_of_layers_does_not_matter():
+    y = np.linspace(-25., 35., 1001)
+    assert np.array_equal(layer_indices(LAYERS, y), layer_indices(LAYERS[::-1], y))
+
+
+def test_matches_shape_by_shape_assignment():
+    #Assigning the layers one after the other, top down as in the spec, with the
+    #inclusive bounds of a Layer shape: the last one added wins on a boundary
+    y = np.concatenate([np.linspace(-25., 35., 2001), [0., -4., -10., -12., -20., 30.]])
+    expected = np.full(len(y), -1)
+    for bottom, top, index in LAYERS:
+        expected[(y >= bottom) & (y <= top)] = index
+    assert np.array_equal(layer_indices(LAYERS, y), expected)
@@ -0,0 +1,176 @@
+import sys
+import types
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from rift_nonlinear import NonlinearStrategy
+from rift_solver import IterationCounter, PreconditionerReuse
+
+
+class Solver(object):
+    """Calls callback_post_solve once per nonlinear iteration, like the
+    underworld Stokes solver once each solution is on the nodes."""
+
+    def __init__(self, Model, iterations):
+        self.Model = Model
+        self.iterations = iterations
+
+    def solve(self, nonLinearIterate=True, callback_post_solve=None, **kwargs):
+        for _ in range(self.iterations):
+            self.Model.iterate()
+            callback_post_solve()
+
+
+class Model(object):
+    """Model.solve and Model._callback_post_solve as in UWGeodynamics 2.13: the
+    callback is bound when solve() runs, and there is no callback_post_solve."""
+
+    def __init__(self, iterations=4):
+        self.callback_functions = OrderedDict()
+        self.solver = Solver(self, iterations)
+        self.nlstep = 0
+
+    def iterate(self):
+        pass
+
+    def solve(self):
+        self.nlstep = 0
+        self.solver.solve(nonLinearIterate=True, callback_post_solve=self._callback_post_solve)
+
+    def _callback_post_solve(self):
+        for key, val in self.callback_functions.items():
+            val()
+        self.nlstep += 1
+
+
+def test_iteration_counter_counts_the_solver_iterations():
+    model = Model(iterations=4)
+    counter = IterationCounter(model, "test")
+    model.solve()
+    assert counter.take() == model.nlstep == 4
+    model.solve()
+    assert counter.take() == 4
+    counter.remove()
+    model.solve()
+    assert counter.take() == 0
+
+
+def test_counters_do_not_replace_each_other():
+    model = Model(iterations=3)
+    first, second = IterationCounter(model, "first"), IterationCounter(model, "second")
+    model.solve()
+    first.remove()
+    model.solve()
+    assert (first.take(), second.take()) == (3, 6)
+
+
+def test_model_without_callback_functions():
+    model = Model()
+    del model.callback_functions
+    with pytest.raises(AttributeError):
+        IterationCounter(model)
+
+
+class Field(object):
+    def __init__(self, data):
+        self.data = data
+
+
+class Comm(object):
+    rank, size = 0, 1
+
+    def allreduce(self, value, op=None):
+        return value
+
+
+class PicardModel(Model):
+    """Each nonlinear iteration is the linear contraction x -> M x + c of the
+    velocity and pressure on the nodes, so a mixture left on the nodes by the
+    callback is what the next iteration starts from."""
+
+    def __init__(self, iterations):
+        super(PicardModel, self).__init__(iterations)
+        self.velocityField = Field(np.zeros((2, 2)))
+        self.pressureField = Field(np.zeros((2, 1)))
+        self.pre_solve_functions = OrderedDict()
+        self.post_solve_functions = OrderedDict()
+        self.M = np.array([0.95, 0.9, 0.8, 0.7, 0.6, 0.5])
+        self.c = np.arange(1., 7.)
+        self.outputs = []
+
+    def state(self):
+        return np.concatenate([self.velocityField.data.ravel(), self.pressureField.data.ravel()])
+
+    def iterate(self):
+        x = self.M * self.state() + self.c
+        self.velocityField.data[:] = x[:4].reshape(2, 2)
+        self.pressureField.data[:] = x[4:].reshape(2, 1)
+        self.outputs.append(x)
+
+    def error(self):
+        return np.max(np.abs(self.state() - self.c / (1. - self.M)))
+
+
+def _solve(monkeypatch, tmp_path, options, iterations=8):
+    GEO = types.SimpleNamespace(rcParams={"nonlinear.tolerance": 1e-2, "nonlinear.max.iterations": 50})
+    monkeypatch.setitem(sys.modules, "rift_model", types.SimpleNamespace(GEO=GEO))
+    model = PicardModel(iterations)
+    strategy = NonlinearStrategy(model, options, Comm(), path=str(tmp_path / "nonlinear.jsonl"))
+    model.mixed = []
+    model.callback_functions["record"] = lambda: model.mixed.append(model.state())
+    strategy.start_step()
+    model.solve()
+    return model, strategy
+
+
+def test_anderson_mixture_is_applied(monkeypatch, tmp_path):
+    options = {"anderson": {"start": 1e9, "depth": 6}}
+    model, strategy = _solve(monkeypatch, tmp_path, options)
+    plain, _ = _solve(monkeypatch, tmp_path, {"anderson": None})
+    assert len(strategy._changes) == model.nlstep == 8
+    #From the second accelerated iterate on, the nodes hold the mixture, not the Picard iterate
+    assert np.array_equal(model.mixed[0], model.outputs[0])
+    assert not np.allclose(model.mixed[2], model.outputs[2])
+    assert np.array_equal(plain.mixed[2], plain.outputs[2])
+    assert model.error() < 1e-6 < plain.error()
+
+
+class StatsSolver(Solver):
+    """Solver with the statistics of its last linear solve, A11 iterations
+    taken from A11Iterations once per linear solve."""
+
+    def __init__(self, Model, iterations, A11Iterations):
+        super(StatsSolver, self).__init__(Model, iterations)
+        self.A11Iterations = iter(A11Iterations)
+        self.options = types.SimpleNamespace(A11=types.SimpleNamespace(ksp_reuse_preconditioner=False))
+        self.reused = []
+
+    def solve(self, **kwargs):
+        self.reused.append(self.options.A11.ksp_reuse_preconditioner)
+        super(StatsSolver, self).solve(**kwargs)
+
+    def get_stats(self):
+        return types.SimpleNamespace(velocity_presolve_its=2, velocity_backsolve_its=2, pressure_its=4,
+                                     velocity_pressuresolve_its=next(self.A11Iterations))
+
+
+def test_preconditioner_refresh_follows_the_iterations_of_every_linear_solve():
+    model = Model(iterations=2)
+    model.pre_solve_functions = OrderedDict()
+    #6 A11 solves per linear solve, 2 linear solves per step
+    model.solver = StatsSolver(model, 2, [8, 8,  8, 8,  8, 8,  8, 44,  8, 8])
+    reuse = PreconditionerReuse(model, {"refreshFactor": 2.0, "maxAge": 50}, Comm())
+    for step in range(6):
+        for function in model.pre_solve_functions.values():
+            function()
+        if step < 5:
+            model.solve()
+    #Only the second linear solve of the fourth step degrades, (12 + 48) / 12 > 2 * 2
+    assert model.solver.reused == [False, True, True, True, False]
+    assert model.solver.options.A11.ksp_reuse_preconditioner is True
+    assert reuse.refreshes == 1
+    reuse.close()
+    assert "Preconditioner reuse" not in model.callback_functions
+    assert model.solver.options.A11.ksp_reuse_preconditioner is False
@@ -0,0 +1,28 @@
+import os
+import stat
+import sys
+
+from rift_sweep import launch_members, member_commands
+
+
+def _sweep(tmp_path):
+    return {"outputDir": str(tmp_path / "sweep"), "members": [{"name": "v1"}, {"name": "v2"}]}
+
+
+def test_one_mpi_launch_per_member(tmp_path):
+    commands = member_commands("sweep.json", _sweep(tmp_path), 48, check=True)
+    assert [command[:3] for command in commands] == [["mpirun", "-np", "48"]] * 2
+    assert [command[command.index("--member") + 1] for command in commands] == ["v1", "v2"]
+    assert all(command[-1] == "--check" for command in commands)
+
+
+def test_failed_members_are_reported(tmp_path):
+    #Stands in for mpirun: logs its arguments and fails for member v2
+    mpirun = tmp_path / "mpirun"
+    mpirun.write_text("#!{0}\nimport sys\nprint(' '.join(sys.argv[1:]))\n"
+                      "sys.exit(1 if 'v2' in sys.argv else 0)\n".format(sys.executable))
+    mpirun.chmod(mpirun.stat().st_mode | stat.S_IEXEC)
+    sweep = _sweep(tmp_path)
+    assert launch_members("sweep.json", sweep, 4, mpirun=str(mpirun)) == ["v2"]
+    with open(os.path.join(sweep["outputDir"], "logs", "v1.log")) as f:
+        assert f.read().startswith("-np 4 ")
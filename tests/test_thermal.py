@@ -0,0 +1,132 @@
+import sys
+import types
+from collections import OrderedDict
+
+import numpy as np
+
+import rift_thermal
+from rift_thermal import LaggedThermalSolve
+
+
+class _CheckpointFunction(object):
+    """run_for's periodic checkpoint in UWGeodynamics 2.13: the fields, the
+    tracers and then the swarm, never through Model.checkpoint."""
+
+    def __init__(self, Model):
+        self.Model = Model
+
+    def checkpoint(self):
+        self.checkpoint_fields()
+        self.checkpoint_tracers()
+
+    def checkpoint_fields(self, fields=None, checkpointID=None):
+        self.Model.log.append(("fields", self.Model.temperature.data[0, 0]))
+
+    def checkpoint_tracers(self, tracers=None, checkpointID=None):
+        pass
+
+
+class Source(object):
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, mesh):
+        return np.full((len(mesh.data), 1), self.value)
+
+
+class System(object):
+    def __init__(self, Model):
+        self.Model = Model
+        Model.built.append(self)
+
+    def integrate(self, dt):
+        self.Model.log.append(("integrate", dt))
+        self.Model.temperature.data[:, 0] += self.Model.HeatProdFn.value * dt
+
+
+class Model(object):
+    """As in UWGeodynamics 2.13, _advdiffSystem builds a new system, and sets
+    HeatProdFn, every time it is read."""
+
+    def __init__(self, heat=1.):
+        self.mesh = types.SimpleNamespace(data=np.zeros((3, 2)))
+        self.velocityField = types.SimpleNamespace(data=np.zeros((3, 2)))
+        self.temperature = types.SimpleNamespace(
+            data=np.zeros((3, 1)), fn_gradient=types.SimpleNamespace(evaluate=lambda mesh: np.zeros((3, 2))))
+        self.swarm = object()
+        self.outputDir = None
+        self.heat = heat
+        self.built = []
+        self.log = []
+
+    @property
+    def _advdiffSystem(self):
+        self.HeatProdFn = Source(self.heat)
+        return System(self)
+
+    def restart(self, step, restartDir=None):
+        pass
+
+    def _update(self, dt):
+        self._advdiffSystem.integrate(dt)
+
+
+class Comm(object):
+    rank, size = 0, 1
+
+    def allreduce(self, value, op=None):
+        return value
+
+
+def _lagged(monkeypatch, every=3, maxChange=1e9):
+    monkeypatch.setitem(sys.modules, "rift_model", types.SimpleNamespace(
+        GEO=types.SimpleNamespace(nd=lambda value: value), _q=lambda value: value))
+    monkeypatch.setattr(rift_thermal, "fixed_temperature_nodes",
+                        lambda Model, spec: np.array([True, False, False]))
+    model = Model()
+    lagged = LaggedThermalSolve(model, {"thermalLag": {"every": every, "maxChange": maxChange}}, Comm())
+    return model, lagged
+
+
+def test_thermal_solve_is_lagged(monkeypatch):
+    model, lagged = _lagged(monkeypatch)
+    for dt in (1., 2., 3., 4.):
+        model._update(dt)
+    assert len(model.built) == 1
+    assert model.log == [("integrate", 6.)]
+    assert lagged.pending == 4.
+    lagged.close()
+    assert model.log[-1] == ("integrate", 4.)
+    assert np.allclose(model.temperature.data[:, 0], 10.)
+    model._update(1.)
+    assert model.log[-1] == ("integrate", 1.)
+
+
+def test_heating_is_conservative(monkeypatch):
+    model, lagged = _lagged(monkeypatch)
+    model._update(1.)
+    model._update(1.)
+    #The source doubles before the solve, only the last step gets the new one
+    model.HeatProdFn.value = 2.
+    model._update(1.)
+    #Fixed node 0 only gets what the solve puts in
+    assert np.allclose(model.temperature.data[:, 0], [6., 4., 4.])
+    lagged.close()
+
+
+def test_large_change_solves_early(monkeypatch):
+    model, lagged = _lagged(monkeypatch, every=10, maxChange=2.5)
+    for dt in (1., 1., 1.):
+        model._update(dt)
+    assert model.log == [("integrate", 3.)]
+    lagged.close()
+
+
+def test_pending_solve_is_flushed_before_a_checkpoint(monkeypatch):
+    model, lagged = _lagged(monkeypatch)
+    model._update(1.)
+    model._update(1.)
+    _CheckpointFunction(model).checkpoint()
+    assert model.log == [("integrate", 2.), ("fields", 2.)]
+    assert lagged.pendingSteps == 0
+    lagged.close()
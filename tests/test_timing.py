@@ -0,0 +1,45 @@
+import time
+from collections import OrderedDict
+
+from rift_timing import StepTimer
+
+
+class System(object):
+    def __init__(self, built):
+        built.append(self)
+
+    def integrate(self, dt):
+        time.sleep(0.01)
+
+
+class Model(object):
+    """The parts of a UWGeodynamics 2.13 Model the step timer hooks into. As in
+    2.13, _advdiffSystem builds a new system every time it is read."""
+
+    def __init__(self, outputDir):
+        self.outputDir = outputDir
+        self.pre_solve_functions = OrderedDict()
+        self.callback_functions = OrderedDict()
+        self.passive_tracers = {}
+        self.swarm = object()
+        self.built = []
+
+    @property
+    def _advdiffSystem(self):
+        return System(self.built)
+
+    def solve(self):
+        pass
+
+    def _update(self):
+        self._advdiffSystem.integrate(1.)
+
+
+def test_advection_diffusion_is_timed(tmp_path):
+    model = Model(str(tmp_path))
+    timer = StepTimer(model, comm=None)
+    model._update()
+    model._update()
+    assert len(model.built) == 1
+    assert timer.elapsed["advection-diffusion"] >= 0.02
+    timer.close()
@@ -0,0 +1,24 @@
+import h5py
+import numpy as np
+
+from rift_output import TracerSeries
+
+
+def _append(series, times):
+    for step, time in enumerate(times):
+        series.append(time, step, np.full((series.ntracers, 2), time))
+
+
+def test_restart_keeps_the_row_it_restarted_from(tmp_path):
+    _append(TracerSeries(str(tmp_path), "Surface", 3, 0.), [5000., 10000., 15000., 20000.])
+    #Restarted from the checkpoint at 10 kyr, the first output after it is at 15 kyr again
+    _append(TracerSeries(str(tmp_path), "Surface", 3, 10000.), [15000., 20000.])
+    with h5py.File(str(tmp_path / "Surface.h5"), "r") as f:
+        assert list(f["time"][...]) == [5000., 10000., 15000., 20000.]
+        assert np.array_equal(f["coordinates"][0, :, 0], f["time"][...])
+
+
+def test_trajectories_are_chunked_per_tracer(tmp_path):
+    _append(TracerSeries(str(tmp_path), "Moho", 100, 0.), [1., 2.])
+    with h5py.File(str(tmp_path / "Moho.h5"), "r") as f:
+        assert f["coordinates"].chunks[0] == 1